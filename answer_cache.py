@@ -0,0 +1,100 @@
+"""
+Кэш ответов на первые сообщения диалога.
+
+Первые сообщения часто почти одинаковые и абстрактные ("Хочу накачаться",
+"Как заработать"), а ответ на них по системному промпту - провокация и
+уточняющие вопросы. Пока история пустая, ответ зависит только от текста,
+поэтому его можно переиспользовать. По ключу копится несколько вариантов
+ответа, чтобы пользователи не получали один и тот же текст.
+"""
+
+import random
+import re
+import time
+from collections import OrderedDict
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """Ключ кэша: нижний регистр, ё->е, без пунктуации/эмодзи и лишних пробелов"""
+    text = text.lower().replace('ё', 'е')
+    text = _PUNCTUATION.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+class CachedAnswer:
+    """Вариант ответа и во что он обошёлся при генерации"""
+    __slots__ = ('text', 'latency', 'tokens')
+
+    def __init__(self, text: str, latency: float, tokens: int):
+        self.text = text
+        self.latency = latency
+        self.tokens = tokens
+
+
+class AnswerCache:
+    """LRU кэш с TTL: ключ -> до variants вариантов ответа"""
+
+    def __init__(self, max_keys: int = 1000, ttl: float = 86400, variants: int = 3, max_length: int = 80):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.variants = variants
+        # Длинные сообщения почти всегда конкретные - их не кэшируем
+        self.max_length = max_length
+        self._entries = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.latency_saved = 0.0
+        self.tokens_saved = 0
+
+    def key_for(self, text: str) -> str | None:
+        """Ключ кэша или None, если сообщение не подходит для кэша"""
+        if len(text) > self.max_length:
+            return None
+        key = normalize(text)
+        return key or None
+
+    def get(self, key: str) -> str | None:
+        """Случайный вариант ответа, если по ключу уже накоплено variants вариантов"""
+        self.lookups += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, answers = entry
+        if time.monotonic() - created_at > self.ttl:
+            del self._entries[key]
+            return None
+        if len(answers) < self.variants:
+            # Ещё копим разнообразие - отвечает модель
+            return None
+        self._entries.move_to_end(key)
+        answer = random.choice(answers)
+        self.hits += 1
+        self.latency_saved += answer.latency
+        self.tokens_saved += answer.tokens
+        return answer.text
+
+    def add(self, key: str, text: str, latency: float, tokens: int):
+        """Сохранение ответа модели как ещё одного варианта"""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = (time.monotonic(), [])
+        answers = entry[1]
+        if len(answers) < self.variants and all(answer.text != text for answer in answers):
+            answers.append(CachedAnswer(text, latency, tokens))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Попадания и сэкономленные время/токены"""
+        return {
+            'keys': len(self._entries),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'latency_saved': self.latency_saved,
+            'tokens_saved': self.tokens_saved,
+        }
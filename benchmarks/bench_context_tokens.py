@@ -0,0 +1,56 @@
+"""
+Распределение входных токенов: окно по количеству сообщений против окна по бюджету.
+
+Запуск: python benchmarks/bench_context_tokens.py [диалогов] [бюджет_токенов]
+
+Синтетические диалоги со смесью коротких и длинных сообщений. "до" - как
+раньше: системный промпт + последние MAX_HISTORY сообщений целиком.
+"после" - ContextWindow с бюджетом и summary вместо выпавших сообщений
+(summary берётся фиксированной длины, как ограничено в SUMMARY_PROMPT).
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import ContextWindow, estimate_message_tokens  # noqa: E402
+from quantiles import percentile  # noqa: E402
+from conversations import ChatHistory  # noqa: E402
+from tyler import CONTEXT_TOKEN_BUDGET, MAX_HISTORY, SYSTEM_MESSAGE  # noqa: E402
+
+SHORT = 'Вешу 80кг, подтягиваюсь 3 раза, зала нет'
+LONG = 'Понимаешь, у меня сложная ситуация на работе и дома, ' * 30
+
+
+def main():
+    dialogs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else CONTEXT_TOKEN_BUDGET
+    rng = random.Random(1)
+    window = ContextWindow(SYSTEM_MESSAGE, budget)
+    before = []
+    system_tokens = estimate_message_tokens(SYSTEM_MESSAGE['content'])
+
+    for _ in range(dialogs):
+        history = ChatHistory(MAX_HISTORY)
+        for i in range(rng.randint(1, 40)):
+            role = 'user' if i % 2 == 0 else 'assistant'
+            content = LONG if rng.random() < 0.25 else SHORT
+            history.append(role, content)
+
+        before.append(system_tokens + sum(turn.tokens for turn in history))
+        _, overflow = window.build(history)
+        if overflow:
+            # Как после фонового сжатия: выпавшее заменено summary
+            history.compact(history.oldest(overflow), 'x' * 800)
+
+    after = list(window.sent_tokens)
+    print(f'Диалогов: {dialogs}, MAX_HISTORY={MAX_HISTORY}, бюджет {budget}')
+    for name, values in (('до', before), ('после', after)):
+        print(f'{name:<6} p50 {percentile(values, 0.5):6}  p95 {percentile(values, 0.95):6}  '
+              f'max {max(values):6}  среднее {sum(values) / len(values):8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Бенчмарк памяти и скорости истории диалогов: списки словарей против ChatHistory.
+
+Запуск: python benchmarks/bench_history_memory.py [пользователей] [сообщений_на_пользователя]
+
+Старая схема: у каждого пользователя список, начинающийся со своего словаря
+системного промпта (плюс cache_control), обрезка копированием списка.
+Новая: кольцевой буфер Turn со __slots__, промпт общий. Текст сообщений
+одинаковый в обоих случаях и в замер не входит - меряется только накладная
+память структуры.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversations import ChatHistory  # noqa: E402
+from tyler import MAX_HISTORY, SYSTEM_MESSAGE, SYSTEM_PROMPT  # noqa: E402
+
+MESSAGES = [f'сообщение {i}' for i in range(64)]
+
+
+def legacy_add(chats: dict, user_id: int, role: str, content: str):
+    """Копия старых get_user_history/add_to_history/send_to_chatgpt"""
+    history = chats.get(user_id)
+    if not history:
+        history = chats[user_id] = [{'role': 'system', 'content': SYSTEM_PROMPT}]
+        history[0]['cache_control'] = {'type': 'ephemeral'}
+    history.append({'role': role, 'content': content})
+    if len(history) > MAX_HISTORY + 1:
+        chats[user_id] = [history[0]] + history[-MAX_HISTORY:]
+
+
+def compact_add(chats: dict, user_id: int, role: str, content: str):
+    history = chats.get(user_id)
+    if history is None:
+        history = chats[user_id] = ChatHistory(MAX_HISTORY)
+    history.append(role, content)
+
+
+def measure(name: str, add, users: int, per_user: int):
+    chats = {}
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(per_user):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        content = MESSAGES[i % len(MESSAGES)]
+        for user_id in range(users):
+            add(chats, user_id, role, content)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    appends = users * per_user
+    print(f'{name:<8} память {current / 2 ** 20:8.1f} MiB  '
+          f'({current / users:6.0f} байт/польз.)  '
+          f'append {elapsed / appends * 1e9:6.0f} нс')
+    return chats
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(f'Пользователей: {users}, сообщений на пользователя: {per_user}, MAX_HISTORY={MAX_HISTORY}')
+    measure('legacy', legacy_add, users, per_user)
+    chats = measure('compact', compact_add, users, per_user)
+
+    started = time.perf_counter()
+    for user_id in range(min(users, 10_000)):
+        chats[user_id].to_messages(SYSTEM_MESSAGE)
+    per_call = (time.perf_counter() - started) / min(users, 10_000)
+    print(f'сборка payload (to_messages) {per_call * 1e6:.1f} мкс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Бенчмарк задержки вызова ProxyAPI: новая ClientSession на запрос против общего пула.
+
+Запуск: python benchmarks/bench_http_session.py [кол-во_запросов] [задержка_upstream_мс]
+
+Upstream - локальный mock, поэтому разница показывает только стоимость
+TCP соединения и создания сессии. В проде к ней добавляются DNS и TLS
+рукопожатие до api.proxyapi.ru, так что реальная экономия больше.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_proxyapi import MockProxyAPI  # noqa: E402
+from proxyapi import ProxyAPIClient  # noqa: E402
+from quantiles import percentile  # noqa: E402
+
+PAYLOAD = {'model': 'gpt-5-mini', 'messages': [{'role': 'user', 'content': 'Хочу накачаться'}]}
+
+
+async def per_call_session(url: str) -> float:
+    """Старый путь: новая сессия на каждый запрос"""
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=PAYLOAD) as response:
+            await response.json()
+    return time.perf_counter() - started
+
+
+async def pooled(client: ProxyAPIClient) -> float:
+    started = time.perf_counter()
+    async with client.post(PAYLOAD) as response:
+        await response.json()
+    return time.perf_counter() - started
+
+
+def report(name: str, samples: list, connections: int):
+    p95 = percentile(samples, 0.95)
+    print(f'{name:<12} median {statistics.median(samples) * 1000:7.3f}ms  '
+          f'p95 {p95 * 1000:7.3f}ms  соединений: {connections}')
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+
+    mock = MockProxyAPI(latency=latency)
+    url = await mock.start()
+    print(f'Запросов: {count}, задержка upstream: {latency * 1000:.0f}ms')
+
+    samples = [await per_call_session(url) for _ in range(count)]
+    report('per-call', samples, mock.connections)
+
+    mock.reset()
+    client = ProxyAPIClient(url, 'bench-key')
+    await client.start()
+    samples = [await pooled(client) for _ in range(count)]
+    report('pooled', samples, mock.connections)
+    await client.close()
+
+    await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""
+Нагрузочный тест бота целиком: синтетические пользователи через настоящие хендлеры.
+
+Запуск: python benchmarks/bench_load.py [--users 300] [--messages 5] [--premium 0.2] ...
+(все параметры - python benchmarks/bench_load.py --help)
+
+Application собирается тем же build_application(), что и в main(), и
+получает апдейты long polling'ом от fake Telegram (benchmarks/fake_telegram.py),
+ответы AI идут из mock ProxyAPI. Оба работают в отдельных процессах, у обоих
+настраиваются задержка и доля ошибок (503 от AI, 429 с retry_after от
+Telegram). Сценарий: каждый пользователь присылает /start и затем несколько
+вопросов; часть пользователей с премиумом, бесплатные упираются в дневной
+лимит. Два прогона на разных пользователях: пачка (всё разом) и равномерный
+поток. Склейка быстрых сообщений работает с настройками по умолчанию: на
+склеенную реплику приходит один ответ со всеми её метками. Отчёт: апдейтов
+в секунду, задержка "апдейт создан -> ответ AI получен" p50/p95/p99,
+сколько сообщений склеено и обращений к БД на сообщение.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_workers import mock_process  # noqa: E402
+from benchmarks.fake_telegram import TOKEN, FakeTelegram  # noqa: E402
+from quantiles import percentile  # noqa: E402
+
+QUESTIONS = [
+    'Как перестать откладывать всё на завтра?',
+    'Не могу заставить себя ходить в зал',
+    'Хочу сменить работу, но страшно',
+    'Как бросить залипать в телефон по вечерам?',
+    'Что делать, если нет мотивации вообще ни на что',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест tyler.py на fake Telegram и mock ProxyAPI')
+    parser.add_argument('--users', type=int, default=300, help='пользователей в каждом прогоне')
+    parser.add_argument('--messages', type=int, default=5, help='вопросов от пользователя (плюс /start)')
+    parser.add_argument('--premium', type=float, default=0.2, help='доля пользователей с премиумом')
+    parser.add_argument('--daily-limit', type=int, default=3, help='бесплатных запросов в день')
+    parser.add_argument('--rate', type=float, default=100, help='темп равномерного потока, сообщений/с')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='задержка ответа AI, сек')
+    parser.add_argument('--llm-errors', type=float, default=0.0, help='доля ответов AI с 503')
+    parser.add_argument('--llm-slots', type=int, default=8, help='LLM_MAX_IN_FLIGHT бота')
+    parser.add_argument('--tg-latency', type=float, default=0.005, help='задержка ответа Telegram, сек')
+    parser.add_argument('--tg-flood', type=float, default=0.0, help='доля sendMessage с 429')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='настоящие лимиты отправки (30/с на бота, 1/с на чат) вместо снятых')
+    return parser.parse_args()
+
+
+def fake_process(conn, latency: float, flood_rate: float):
+    """Fake Telegram в отдельном процессе; команды - сценарии для play()"""
+    async def main():
+        fake = FakeTelegram(latency=latency, flood_rate=flood_rate)
+        conn.send(await fake.start())
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command is None:
+                break
+            conn.send(await fake.play(*command))
+        await fake.stop()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(main())
+
+
+def scenario(first_user: int, users: int, messages: int) -> list[tuple[int, str]]:
+    """/start от всех, затем вопросы вперемешку (пользователи пишут одновременно)"""
+    user_ids = list(range(first_user, first_user + users))
+    plan = [(user_id, '/start') for user_id in user_ids]
+    for _ in range(messages):
+        random.shuffle(user_ids)
+        plan.extend((user_id, random.choice(QUESTIONS)) for user_id in user_ids)
+    return plan
+
+
+def bot_env(args, fake_url: str, mock_url: str) -> dict:
+    env = {
+        'TELEGRAM_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': f'{fake_url}/bot',
+        'PROXYAPI_URL': mock_url,
+        'PROXYAPI_KEY': 'bench',
+        'DAILY_LIMIT': str(args.daily_limit),
+        'STREAM_RESPONSES': '0',
+        'UPDATE_MODE': 'polling',
+        'WORKERS': '1',
+        # Быстрый повтор после 503, иначе прогон меряет паузы backoff
+        'PROXYAPI_MAX_RETRIES': '1',
+        'LLM_MAX_IN_FLIGHT': str(args.llm_slots),
+    }
+    if not args.telegram_limits:
+        env.update({'TELEGRAM_GLOBAL_RATE': '100000', 'TELEGRAM_CHAT_RATE': '1000'})
+    return env
+
+
+def counters(tyler) -> dict:
+    """Накопительные счётчики подсистем - отчёт печатает их прирост за прогон"""
+    upstream = tyler.proxyapi.stats()
+    coalesced = tyler.coalescer.stats()
+    return {
+        'db_ops': tyler.storage.operations,
+        'llm_failures': upstream['failures'],
+        'llm_retries': upstream['retries'],
+        'send_retries': tyler.flood_limiter.stats()['retries'],
+        'spam': tyler.spam_limiter.stats()['rejected'],
+        'busy': tyler.llm_scheduler.stats()['rejected'],
+        'turns': coalesced['turns'],
+        'merged': coalesced['merged'],
+    }
+
+
+def report(name: str, total: int, result: dict, delta: dict, tyler):
+    latencies = result['latencies']
+    db_ops = delta['db_ops']
+    print(f'\n{name}: {total} апдейтов за {result["elapsed"]:.2f} с - {total / result["elapsed"]:.0f} апд/с')
+    print(f'  ответов AI: {len(latencies)}, задержка p50 {percentile(latencies, 0.5) * 1000:.0f} мс  '
+          f'p95 {percentile(latencies, 0.95) * 1000:.0f} мс  p99 {percentile(latencies, 0.99) * 1000:.0f} мс')
+    print(f'  реплик: {delta["turns"]}, склеено сообщений {delta["merged"]}, '
+          f'без ответа {result["unanswered"]}')
+    print(f'  обращений к БД: {db_ops} ({db_ops / total:.2f} на сообщение)')
+    print(f'  AI: ошибок {delta["llm_failures"]}, повторов {delta["llm_retries"]}, '
+          f'отказов "все слоты заняты" {delta["busy"]}, ожидание слота p95 {tyler.llm_scheduler.stats()["wait_p95"]:.2f} с')
+    print(f'  Telegram 429: {result["floods"]}, повторов отправки {delta["send_retries"]}; '
+          f'антиспам отсёк {delta["spam"]}')
+
+
+async def main():
+    args = parse_args()
+    # Ошибки AI и 429 в сценарии ожидаемы - итог в отчёте, а не в логе
+    logging.disable(logging.ERROR)
+    loop = asyncio.get_running_loop()
+
+    mock, mock_child = multiprocessing.Pipe()
+    mock_proc = multiprocessing.Process(target=mock_process, args=(mock_child, args.llm_latency, args.llm_errors),
+                                        daemon=True)
+    mock_proc.start()
+    fake, fake_child = multiprocessing.Pipe()
+    fake_proc = multiprocessing.Process(target=fake_process, args=(fake_child, args.tg_latency, args.tg_flood),
+                                        daemon=True)
+    fake_proc.start()
+    mock_url = await loop.run_in_executor(None, mock.recv)
+    fake_url = await loop.run_in_executor(None, fake.recv)
+
+    async def play(plan, rate=None):
+        fake.send((plan, rate))
+        return await loop.run_in_executor(None, fake.recv)
+
+    workdir = tempfile.TemporaryDirectory()
+    # tyler читает конфиг при импорте, а users.db открывает в текущем каталоге
+    os.environ.update(bot_env(args, fake_url, mock_url))
+    os.chdir(workdir.name)
+    import tyler
+
+    application = tyler.build_application()
+    await application.initialize()
+    await application.post_init(application)
+    premium = int(args.users * args.premium)
+    for first_user in (1, 1_000_001):
+        for user_id in range(first_user, first_user + premium):
+            await tyler.add_premium(user_id)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    print(f'Пользователей: {args.users} (премиум {premium}), /start + {args.messages} вопросов, '
+          f'лимит {args.daily_limit}/день; AI {args.llm_latency * 1000:.0f} мс, ошибок {args.llm_errors:.0%}; '
+          f'Telegram {args.tg_latency * 1000:.0f} мс, 429 {args.tg_flood:.0%}')
+
+    try:
+        for name, first_user, rate in (('Пачка', 1, None), (f'Поток {args.rate:.0f}/с', 1_000_001, args.rate)):
+            plan = scenario(first_user, args.users, args.messages)
+            before = counters(tyler)
+            result = await play(plan, rate)
+            # Хвост записей (логи, журнал токенов, истории) - тоже цена этих сообщений
+            await tyler.request_log.flush()
+            await tyler.usage_ledger.flush()
+            await tyler.conversations.flush()
+            after = counters(tyler)
+            report(name, len(plan), result, {key: after[key] - before[key] for key in after}, tyler)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        fake.send(None)
+        mock.send(None)
+        fake_proc.join(10)
+        mock_proc.join(10)
+        os.chdir('/')
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
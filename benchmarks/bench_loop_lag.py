@@ -0,0 +1,125 @@
+"""
+Бенчмарк задержки event loop: старые блокирующие вызовы sqlite3 против Storage.
+
+Запуск: python benchmarks/bench_loop_lag.py [кол-во_операций] [параллельность]
+
+Пока идёт нагрузка на БД, фоновая задача каждые 5 мс засыпает и меряет,
+насколько позже положенного она проснулась. Это и есть лаг loop'а, который
+видят все остальные чаты. Третий прогон - Storage с отложенной пакетной
+записью логов запросов (RequestLog) вместо коммита на каждый запрос.
+"""
+
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantiles import percentile  # noqa: E402
+from request_log import RequestLog  # noqa: E402
+from storage import Storage  # noqa: E402
+
+TICK = 0.005
+
+
+async def measure_lag(stop: asyncio.Event, samples: list):
+    """Фоновая задача, которая меряет опоздание пробуждений loop'а"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - started - TICK)
+
+
+def blocking_message(db_file: str, user_id: int):
+    """Старый путь: новое соединение и commit на каждую операцию"""
+    for sql, args in (
+        ('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,)),
+        ('SELECT COUNT(*) FROM users', ()),
+        ('SELECT premium_until FROM users WHERE user_id = ?', (user_id,)),
+        ("SELECT COUNT(*) FROM request_logs WHERE user_id = ? AND date(timestamp) = date('now')", (user_id,)),
+        ('INSERT INTO request_logs (user_id) VALUES (?)', (user_id,)),
+    ):
+        conn = sqlite3.connect(db_file)
+        conn.execute(sql, args)
+        conn.commit()
+        conn.close()
+
+
+async def run_blocking(db_file: str, ops: int, concurrency: int):
+    async def worker(offset: int):
+        for i in range(offset, ops, concurrency):
+            blocking_message(db_file, i % 1000)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+
+async def run_storage(storage: Storage, ops: int, concurrency: int, request_log: RequestLog | None = None):
+    async def worker(offset: int):
+        for i in range(offset, ops, concurrency):
+            user_id = i % 1000
+            day = time.strftime('%Y-%m-%d')
+            await storage.ensure_user(user_id)
+            await storage.count_users()
+            await storage.get_premium_until(user_id)
+            await storage.count_user_requests_on(user_id, day)
+            if request_log is None:
+                await storage.save_request_logs([(user_id, int(time.time()), day)])
+            else:
+                request_log.add(user_id, int(time.time()), day)
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    if request_log is not None:
+        await request_log.flush()
+
+
+async def bench(name: str, coro_factory):
+    samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop, samples))
+    started = time.perf_counter()
+    await coro_factory()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    p99 = percentile(samples, 0.99)
+    print(f'{name:<10} время {elapsed:7.2f}s  '
+          f'лаг median {statistics.median(samples) * 1000:7.2f}ms  '
+          f'p99 {p99 * 1000:7.2f}ms  max {max(samples) * 1000:7.2f}ms  '
+          f'тиков {len(samples)}')
+
+
+async def main():
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'bench.db')
+        storage = Storage(db_file)
+        await storage.start()
+        # Для честного сравнения старый путь работает с той же схемой, но без WAL
+        await storage.close()
+        with sqlite3.connect(db_file) as conn:
+            conn.execute('PRAGMA journal_mode=DELETE')
+
+        print(f'Сообщений: {ops}, параллельно: {concurrency}')
+        await bench('blocking', lambda: run_blocking(db_file, ops, concurrency))
+
+        storage = Storage(db_file)
+        await storage.start()
+        await bench('storage', lambda: run_storage(storage, ops, concurrency))
+        request_log = RequestLog(storage)
+        await request_log.start()
+        await bench('batched', lambda: run_storage(storage, ops, concurrency, request_log))
+        await request_log.close()
+        print(f'batched    записей пачками: {request_log.flushes}')
+        await storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
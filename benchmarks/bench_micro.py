@@ -0,0 +1,96 @@
+"""
+Микробенчмарки горячих функций tyler.py: время одного вызова в мкс.
+
+Запуск: python benchmarks/bench_micro.py [пользователей] [строк_логов]
+
+Функции вызываются настоящие, на временной БД, заполненной логами запросов и
+журналом токенов за 30 дней, - чтобы регрессия в одной из них (лишний запрос к
+БД, линейный проход, потерянный индекс) была видна цифрой, а не ощущением.
+Сеть не нужна: ни Telegram, ни ProxyAPI здесь не вызываются.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DAY = 86400
+
+
+def report(name: str, calls: int, elapsed: float, db_ops: int):
+    print(f'{name:<36} {calls:>7}  {elapsed / calls * 1e6:9.1f} мкс  БД на вызов {db_ops / calls:.2f}')
+
+
+async def bench(tyler, name: str, func, calls: int):
+    """calls вызовов func(i); корутины ожидаются"""
+    ops = tyler.storage.operations
+    started = time.perf_counter()
+    for i in range(calls):
+        result = func(i)
+        if asyncio.iscoroutine(result):
+            await result
+    report(name, calls, time.perf_counter() - started, tyler.storage.operations - ops)
+
+
+async def seed(tyler, users: int, rows: int):
+    """Логи запросов и журнал токенов за 30 дней, часть пользователей с премиумом"""
+    now = int(time.time())
+    logs = []
+    usage = []
+    for _ in range(rows):
+        user_id = random.randint(1, users)
+        ts = now - random.randint(0, 30 * DAY)
+        day = time.strftime('%Y-%m-%d', time.localtime(ts))
+        logs.append((user_id, ts, day))
+        usage.append((ts, day, user_id, 'gpt-5-mini', 1500, 1024, 300, 100, 0.0009))
+    await tyler.storage.save_request_logs(logs)
+    await tyler.storage.save_usage(usage)
+    for user_id in range(1, users + 1, 10):
+        await tyler.add_premium(user_id)
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    import tyler
+    logging.disable(logging.WARNING)
+
+    await tyler.post_init(None)
+    try:
+        await seed(tyler, users, rows)
+        print(f'БД: {users} пользователей, {rows} логов запросов и строк журнала за 30 дней\n')
+
+        await bench(tyler, 'is_spam', lambda i: tyler.is_spam(i % users), 200000)
+        await bench(tyler, 'add_to_history (в памяти)',
+                    lambda i: tyler.add_to_history(i % 1000, 'user', 'Как перестать откладывать?'), 50000)
+        await bench(tyler, 'add_to_history (подгрузка из БД)',
+                    lambda i: tyler.add_to_history(1000 + i, 'user', 'Первый вопрос'), 2000)
+        await bench(tyler, 'can_make_request (кэш прав)', lambda i: tyler.can_make_request(i % 1000), 50000)
+
+        # Пользователи, которых ещё нет в кэше прав
+        await bench(tyler, 'can_make_request (промах кэша)', lambda i: tyler.can_make_request(users + 1 + i), 5000)
+        await bench(tyler, 'reserve_request (кэш прав)', lambda i: tyler.reserve_request(1 + i % users), 20000)
+
+        await bench(tyler, 'stats: запросы за 24ч', lambda i: tyler.get_requests_last_24h(), 500)
+        await bench(tyler, 'stats: пользователи за 24ч', lambda i: tyler.get_unique_users_last_24h(), 500)
+        await bench(tyler, 'stats: окно 30 дней', lambda i: tyler.get_window_stats(30), 200)
+        await bench(tyler, 'stats: гистограмма 12ч', lambda i: tyler.get_hourly_histogram(12), 500)
+        await bench(tyler, 'stats: расходы за 30 дней', lambda i: tyler.get_usage_stats(24 * 30), 500)
+        await bench(tyler, 'stats: расходы по дням за неделю', lambda i: tyler.get_usage_by_day(7), 500)
+        await bench(tyler, 'stats: дорогие пользователи за 24ч', lambda i: tyler.get_top_spenders(24), 500)
+        await bench(tyler, 'stats: всего пользователей', lambda i: tyler.get_total_users(), 500)
+    finally:
+        await tyler.post_shutdown(None)
+        os.chdir('/')
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Микробенчмарк антиспама и счётчика сообщений бота: списки временных меток
+против RateLimiter/RateMeter.
+
+Запуск: python benchmarks/bench_ratelimit.py [всего_пользователей] [сообщений]
+
+Время идёт по искусственным часам: каждое сообщение сдвигает их на шаг,
+так что пользователи постепенно замолкают. Меряется время на сообщение и
+память после прогона - у старой схемы словарь растёт с каждым новым
+пользователем, у новой в памяти только недавно активные.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import RateLimiter, RateMeter  # noqa: E402
+
+SPAM_LIMIT = 5
+SPAM_WINDOW = 60
+# Шаг часов на сообщение: 3000 сообщений в минуту
+STEP = SPAM_WINDOW / 3000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Legacy:
+    """Копия старых is_spam/track_bot_message (без логирования)"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.user_message_times = defaultdict(list)
+        self.bot_message_times = []
+
+    def is_spam(self, user_id: int) -> bool:
+        current_time = self.clock()
+        self.user_message_times[user_id] = [
+            t for t in self.user_message_times[user_id]
+            if current_time - t < SPAM_WINDOW
+        ]
+        if len(self.user_message_times[user_id]) >= SPAM_LIMIT:
+            return True
+        self.user_message_times[user_id].append(current_time)
+        return False
+
+    def track_bot_message(self):
+        current_time = self.clock()
+        self.bot_message_times = [t for t in self.bot_message_times if current_time - t < 60]
+        self.bot_message_times.append(current_time)
+
+
+class Current:
+    def __init__(self, clock):
+        self.spam_limiter = RateLimiter(SPAM_LIMIT, SPAM_WINDOW, clock=clock)
+        self.bot_messages = RateMeter(60, clock=clock)
+
+    def is_spam(self, user_id: int) -> bool:
+        return not self.spam_limiter.hit(user_id)
+
+    def track_bot_message(self):
+        self.bot_messages.record()
+
+
+def drive(impl, clock, users: int, messages: int):
+    for i in range(messages):
+        clock.now += STEP
+        # Каждый пользователь пишет пачкой из 4 сообщений и уходит
+        user_id = (i // 4) % users
+        if not impl.is_spam(user_id):
+            impl.track_bot_message()
+
+
+def run(name: str, factory, users: int, messages: int):
+    clock = FakeClock()
+    started = time.perf_counter()
+    drive(factory(clock), clock, users, messages)
+    elapsed = time.perf_counter() - started
+
+    # Память - отдельным прогоном: tracemalloc искажает время
+    clock = FakeClock()
+    tracemalloc.start()
+    impl = factory(clock)
+    drive(impl, clock, users, messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<8} {elapsed / messages * 1e9:7.0f} нс/сообщение  '
+          f'память {current / 2 ** 20:7.2f} MiB')
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 40_000
+    print(f'{users} пользователей, {messages} сообщений, {int(SPAM_WINDOW / STEP)} сообщений/мин')
+    run('списки', Legacy, users, messages)
+    run('окно', Current, users, messages)
+
+
+if __name__ == '__main__':
+    main()
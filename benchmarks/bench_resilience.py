@@ -0,0 +1,104 @@
+"""
+Проверка повторов и circuit breaker на mock ProxyAPI с инъекцией ошибок.
+
+Запуск: python benchmarks/bench_resilience.py [кол-во_запросов] [доля_ошибок]
+
+Сценарии:
+1. Случайные 503 с долей error_rate - сколько запросов спасают повторы.
+2. 429 с Retry-After - задержка повтора не меньше Retry-After.
+3. Upstream лежит целиком - breaker размыкается, запросы падают мгновенно,
+   после reset_timeout пробный запрос закрывает цепь.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tyler  # noqa: E402
+from benchmarks.mock_proxyapi import MockProxyAPI  # noqa: E402
+from proxyapi import CircuitBreaker, CircuitOpenError, ProxyAPIClient, ProxyAPIError  # noqa: E402
+
+HISTORY = [{'role': 'user', 'content': 'Хочу накачаться'}]
+
+
+async def use_client(url: str, **kwargs) -> ProxyAPIClient:
+    if tyler.proxyapi is not None:
+        await tyler.proxyapi.close()
+    tyler.proxyapi = ProxyAPIClient(url, 'bench-key', backoff_base=0.01, backoff_cap=0.2, **kwargs)
+    await tyler.proxyapi.start()
+    return tyler.proxyapi
+
+
+async def call() -> str:
+    try:
+        await tyler.send_to_chatgpt(list(HISTORY), model='gpt-5-mini')
+        return 'ok'
+    except CircuitOpenError:
+        return 'circuit'
+    except ProxyAPIError:
+        return 'error'
+
+
+async def random_errors(mock: MockProxyAPI, url: str, count: int, error_rate: float):
+    mock.error_rate = error_rate
+    for retries in (0, 3):
+        client = await use_client(url, max_retries=retries,
+                                  breaker=CircuitBreaker(failure_threshold=10 ** 6))
+        results = [await call() for _ in range(count)]
+        print(f'  повторов {retries}: успешно {results.count("ok")}/{count}, '
+              f'повторено {client.retries}')
+    mock.error_rate = 0.0
+
+
+async def retry_after(mock: MockProxyAPI, url: str):
+    mock.retry_after = 0.3
+    mock.fail_next(429)
+    await use_client(url, max_retries=2)
+    started = time.perf_counter()
+    result = await call()
+    print(f'  429 + Retry-After 0.3s: {result} за {time.perf_counter() - started:.2f}s')
+    mock.retry_after = None
+
+
+async def outage(mock: MockProxyAPI, url: str):
+    client = await use_client(url, max_retries=1, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.5))
+    mock.error_rate = 1.0
+    served_before = mock.requests
+    started = time.perf_counter()
+    results = [await call() for _ in range(20)]
+    print(f'  20 запросов при лежащем upstream за {time.perf_counter() - started:.2f}s: '
+          f'ошибок {results.count("error")}, отбито breaker\'ом {results.count("circuit")}, '
+          f'дошло до upstream {mock.requests - served_before}')
+
+    mock.error_rate = 0.0
+    await asyncio.sleep(0.6)
+    result = await call()
+    print(f'  после восстановления: {result}, circuit {client.breaker.state}, размыканий {client.breaker.trips}')
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    error_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    logging.disable(logging.CRITICAL)
+
+    mock = MockProxyAPI()
+    url = await mock.start()
+    tyler.proxyapi = None
+
+    print(f'1. Случайные 503 ({error_rate:.0%}):')
+    await random_errors(mock, url, count, error_rate)
+    print('2. Retry-After:')
+    await retry_after(mock, url)
+    print('3. Upstream лежит:')
+    await outage(mock, url)
+
+    await tyler.proxyapi.close()
+    await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
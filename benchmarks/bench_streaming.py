@@ -0,0 +1,75 @@
+"""
+Бенчмарк времени до первого видимого текста: обычный ответ против стрима.
+
+Запуск: python benchmarks/bench_streaming.py [задержка_до_первого_токена_мс] [мс_на_токен]
+
+Telegram заменён заглушкой, которая запоминает момент первой отправки и
+считает правки. send_to_chatgpt вызывается настоящий, upstream - локальный mock.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tyler  # noqa: E402
+from benchmarks.mock_proxyapi import MockProxyAPI  # noqa: E402
+from proxyapi import ProxyAPIClient  # noqa: E402
+from streaming import ProgressiveReply  # noqa: E402
+
+
+class FakeMessage:
+    """Заглушка telegram.Message: фиксирует время первой отправки и количество правок"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.first_visible = None
+        self.edits = 0
+
+    async def reply_text(self, text: str):
+        if self.first_visible is None:
+            self.first_visible = time.perf_counter() - self.started
+        return self
+
+    async def edit_text(self, text: str):
+        self.edits += 1
+        return self
+
+
+async def run(streaming: bool, edit_interval: float) -> tuple[float, float, int]:
+    history = [{'role': 'user', 'content': 'Хочу накачаться'}]
+    started = time.perf_counter()
+    message = FakeMessage(started)
+    if streaming:
+        reply = ProgressiveReply(message, edit_interval)
+        response = await tyler.send_to_chatgpt(history, model='gpt-5-mini', on_delta=reply.update)
+        await reply.finish(response)
+    else:
+        response = await tyler.send_to_chatgpt(history, model='gpt-5-mini')
+        await message.reply_text(response)
+    return message.first_visible, time.perf_counter() - started, message.edits
+
+
+async def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.5
+    token_delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 30 / 1000
+
+    mock = MockProxyAPI(latency=latency, token_delay=token_delay,
+                        reply=' '.join(['слово'] * 150))
+    url = await mock.start()
+    tyler.proxyapi = ProxyAPIClient(url, 'bench-key')
+    await tyler.proxyapi.start()
+
+    print(f'До первого токена: {latency * 1000:.0f}ms, на токен: {token_delay * 1000:.0f}ms, токенов: 150')
+    for name, streaming in (('обычный', False), ('стрим', True)):
+        first, total, edits = await run(streaming, tyler.STREAM_EDIT_INTERVAL)
+        print(f'{name:<8} первый текст {first * 1000:8.1f}ms  весь ответ {total * 1000:8.1f}ms  правок {edits}')
+
+    await tyler.proxyapi.close()
+    await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Нагрузочный тест обработки апдейтов: пропускная способность против
+UPDATE_CONCURRENCY и целостность истории каждого пользователя.
+
+Запуск: python benchmarks/bench_update_concurrency.py [пользователей] [сообщений_на_пользователя] [задержка_AI_сек]
+
+Апдейты подаются так же, как их подаёт Application: задача на каждый апдейт
+в порядке прихода. Хендлер имитирует handle_message: читает историю, ждёт
+"ответ AI" и дописывает в неё сообщение. Если два апдейта одного
+пользователя пересеклись или поменялись местами, история будет не по
+порядку - это и проверяется. Для сравнения - SimpleUpdateProcessor из PTB
+(просто параллельно, без очередей пользователей).
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import SimpleUpdateProcessor  # noqa: E402
+
+from updates import PerUserUpdateProcessor  # noqa: E402
+
+
+def make_updates(users: int, per_user: int) -> list[Update]:
+    """Каждый пользователь шлёт пачку сообщений подряд, затем следующий"""
+    date = datetime.now(timezone.utc)
+    updates = []
+    update_id = 0
+    for user_id in range(1, users + 1):
+        for seq in range(per_user):
+            update_id += 1
+            user = User(user_id, f'user{user_id}', False)
+            message = Message(update_id, date, Chat(user_id, Chat.PRIVATE), from_user=user, text=str(seq))
+            updates.append(Update(update_id, message=message))
+    return updates
+
+
+async def run(name: str, processor, updates: list[Update], latency: float):
+    histories = {}
+
+    async def handler(update: Update):
+        history = histories.setdefault(update.effective_user.id, [])
+        snapshot = len(history)
+        await asyncio.sleep(latency)
+        # Как add_to_history после ответа AI: пишем на основе прочитанного
+        del history[snapshot:]
+        history.append(int(update.message.text))
+
+    await processor.initialize()
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(processor.process_update(update, handler(update))) for update in updates]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await processor.shutdown()
+
+    expected = sorted({int(update.message.text) for update in updates})
+    broken = sum(1 for history in histories.values() if history != expected)
+    print(f'{name:<22} {len(updates) / elapsed:8.0f} апдейтов/с  '
+          f'{elapsed:6.2f} с  испорченных историй: {broken}/{len(histories)}')
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    updates = make_updates(users, per_user)
+    print(f'{users} пользователей x {per_user} сообщений, ответ AI {latency * 1000:.0f} мс')
+
+    for concurrency in (1, 4, 16, 64, 256):
+        await run(f'по пользователям, {concurrency}', PerUserUpdateProcessor(concurrency), updates, latency)
+    await run('PTB simple, 64', SimpleUpdateProcessor(64), updates, latency)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
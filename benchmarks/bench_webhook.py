@@ -0,0 +1,149 @@
+"""
+Бенчмарк приёма апдейтов: long polling против webhook на fake Telegram.
+
+Запуск: python benchmarks/bench_webhook.py [пользователей] [сообщений_на_пользователя]
+
+Настоящее Application с PerUserUpdateProcessor и эхо-хендлером говорит с
+локальным fake Bot API (benchmarks/fake_telegram.py), сеть не нужна.
+Fake Telegram работает в отдельном процессе, бот - в этом. Задержка - от
+создания апдейта на стороне "Telegram" до получения им sendMessage с
+ответом. Два замера на режим: пачка сообщений разом (пропускная
+способность) и равномерный поток (задержка без очереди).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, MessageHandler, filters  # noqa: E402
+
+from benchmarks.fake_telegram import TOKEN, FakeTelegram  # noqa: E402
+from quantiles import percentile  # noqa: E402
+from updates import PerUserUpdateProcessor  # noqa: E402
+from webhook import WebhookServer  # noqa: E402
+
+SECRET = 'bench-secret'
+
+
+async def echo(update: Update, context):
+    await update.message.reply_text(f'ok {update.message.text}')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build(base_url: str) -> Application:
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(base_url)
+        # Большой пул httpx на локальной пачке тратит больше CPU на выбор соединения, чем на отправку
+        .connection_pool_size(8)
+        .concurrent_updates(PerUserUpdateProcessor(64))
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+    return application
+
+
+async def measure(fake: FakeTelegram, users: int, per_user: int, rate: float | None) -> tuple:
+    total = users * per_user
+    fake.reset(total)
+    started = time.perf_counter()
+    mark = 0
+    for seq in range(per_user):
+        for user_id in range(1, users + 1):
+            mark += 1
+            fake.inject(user_id, f'сообщение #{mark}')
+            if rate:
+                await asyncio.sleep(1 / rate)
+    await fake.wait_replies()
+    elapsed = time.perf_counter() - started
+    latencies = fake.latencies
+    return total / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99)
+
+
+def fake_process(conn):
+    """Fake Telegram в отдельном процессе, чтобы не делить с ботом одно ядро"""
+    async def main():
+        fake = FakeTelegram()
+        conn.send(await fake.start())
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command is None:
+                break
+            conn.send(await measure(fake, *command))
+        await fake.stop()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(main())
+
+
+def report(mode: str, kind: str, result: tuple):
+    rate, p50, p95, p99 = result
+    print(f'{mode:<8} {kind}: {rate:7.0f} апд/с  задержка p50 {p50 * 1000:6.1f} мс  '
+          f'p95 {p95 * 1000:6.1f} мс  p99 {p99 * 1000:6.1f} мс')
+
+
+async def run_mode(mode: str, users: int, per_user: int):
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=fake_process, args=(child_conn,), daemon=True)
+    process.start()
+    loop = asyncio.get_running_loop()
+    fake_url = await loop.run_in_executor(None, conn.recv)
+
+    application = build(f'{fake_url}/bot')
+    server = None
+    await application.initialize()
+    if mode == 'webhook':
+        port = free_port()
+        server = WebhookServer(application, SECRET, port=port, path='/telegram')
+        await server.start()
+        await application.bot.set_webhook(f'http://127.0.0.1:{port}/telegram', secret_token=SECRET)
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    async def ask(*command):
+        conn.send(command)
+        return await loop.run_in_executor(None, conn.recv)
+
+    try:
+        report(mode, 'пачка', await ask(users, per_user, None))
+        report(mode, 'поток', await ask(20, 5, 50))
+        if server is not None:
+            stats = server.stats()
+            print(f'{mode:<8} разбор: пачки p50 {stats["batch_p50"]}, макс. {stats["batch_max"]}')
+    finally:
+        if server is not None:
+            await server.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        conn.send(None)
+        process.join(10)
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f'Пачка: {users} пользователей x {per_user} сообщений; поток: 100 сообщений по 50/с')
+    for mode in ('polling', 'webhook'):
+        await run_mode(mode, users, per_user)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Нагрузочный тест шардирования: пропускная способность бота от числа воркеров.
+
+Запуск: python benchmarks/bench_workers.py [воркеры через запятую] [пользователей] [сообщений_на_пользователя]
+
+Настоящий tyler.py (все хендлеры, SQLite, история, журнал токенов)
+запускается отдельным процессом с WORKERS=N во временном каталоге и говорит
+с fake Telegram (long polling) и mock ProxyAPI - оба в своих процессах, сеть
+не нужна. Замер - пачка сообщений от многих пользователей разом: апдейтов в
+секунду и задержка "апдейт создан -> ответ бота получен". Прирост с числом
+воркеров ограничен числом ядер: на одном ядре он нулевой (плюс накладные
+расходы фронта), дальше упирается в общую SQLite и fake-процессы.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_webhook import fake_process, report  # noqa: E402
+from benchmarks.fake_telegram import TOKEN  # noqa: E402
+from benchmarks.mock_proxyapi import MockProxyAPI  # noqa: E402
+
+
+def mock_process(conn, latency: float, error_rate: float = 0.0):
+    """Mock ProxyAPI в отдельном процессе"""
+    async def main():
+        mock = MockProxyAPI(latency=latency, error_rate=error_rate, echo_mark=True)
+        conn.send(await mock.start())
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await mock.stop()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(main())
+
+
+def bot_env(workers: int, fake_url: str, mock_url: str) -> dict:
+    """Окружение tyler.py: без лимитов, склейки и стрима, чтобы мерить саму обработку"""
+    env = dict(os.environ)
+    env.update({
+        'WORKERS': str(workers),
+        'TELEGRAM_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': f'{fake_url}/bot',
+        'PROXYAPI_URL': mock_url,
+        'PROXYAPI_KEY': 'bench',
+        'DAILY_LIMIT': '1000000',
+        'SPAM_LIMIT': '1000000',
+        'STREAM_RESPONSES': '0',
+        'COALESCE_WINDOW': '0',
+        'COALESCE_MAX_MESSAGES': '1',
+        'UPDATE_CONCURRENCY': '64',
+        'LLM_MAX_IN_FLIGHT': '256',
+        'TELEGRAM_GLOBAL_RATE': '100000',
+        'TELEGRAM_CHAT_RATE': '1000',
+        'UPDATE_MODE': 'polling',
+    })
+    return env
+
+
+async def run_workers(workers: int, fake, mock_url: str, fake_url: str, users: int, per_user: int):
+    loop = asyncio.get_running_loop()
+
+    async def ask(*command):
+        fake.send(command)
+        return await loop.run_in_executor(None, fake.recv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        log = open(os.path.join(workdir, 'bot.log'), 'w')
+        bot = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'tyler.py')],
+            cwd=workdir, env=bot_env(workers, fake_url, mock_url), stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            # Прогрев: все воркеры подняли БД и сессии, пользователи уже есть в базе
+            started = time.perf_counter()
+            await ask(users, 1, None)
+            print(f'{workers} воркер(ов): старт и прогрев {time.perf_counter() - started:.1f} с')
+            report(f'x{workers}', 'пачка', await ask(users, per_user, None))
+        finally:
+            bot.send_signal(signal.SIGINT)
+            await loop.run_in_executor(None, bot.wait, 60)
+            log.close()
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 2, 4]
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    per_user = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f'Ядер: {os.cpu_count()}; пачка: {users} пользователей x {per_user} сообщений')
+
+    loop = asyncio.get_running_loop()
+    mock, mock_child = multiprocessing.Pipe()
+    mock_proc = multiprocessing.Process(target=mock_process, args=(mock_child, 0.05), daemon=True)
+    mock_proc.start()
+    mock_url = await loop.run_in_executor(None, mock.recv)
+
+    for workers in counts:
+        # Свежий fake Telegram на каждый прогон: своя очередь апдейтов и offset
+        fake, fake_child = multiprocessing.Pipe()
+        fake_proc = multiprocessing.Process(target=fake_process, args=(fake_child,), daemon=True)
+        fake_proc.start()
+        fake_url = await loop.run_in_executor(None, fake.recv)
+        try:
+            await run_workers(workers, fake, mock_url, fake_url, users, per_user)
+        finally:
+            fake.send(None)
+            fake_proc.join(10)
+
+    mock.send(None)
+    mock_proc.join(10)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+"""
+Локальный fake Telegram Bot API для бенчмарков приёма апдейтов.
+
+Понимает ровно то, что нужно боту: getMe, getUpdates (long polling),
+setWebhook/deleteWebhook и sendMessage. Апдейты подаются через inject():
+в режиме polling они копятся и отдаются в getUpdates, в режиме webhook
+отправляются POST-запросами на адрес webhook с секретным заголовком (до
+max_connections одновременно, как делает Telegram). Каждое входящее
+сообщение содержит метку "#<номер>", ответ бота с той же меткой закрывает
+замер задержки "апдейт создан -> sendMessage получен". Ответ на склейку
+нескольких сообщений несёт все их метки.
+
+latency - задержка ответа на каждый исходящий вызов бота, flood_rate - доля
+sendMessage, на которые приходит 429 с retry_after (как при флуде), play() -
+прогон готового сценария сообщений пачкой или с заданным темпом.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+TOKEN = '123456:FAKE-TOKEN'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Tyler', 'username': 'tyler_bench_bot'}
+MARK = re.compile(r'#(\d+)')
+
+
+class FakeTelegram:
+    """aiohttp сервер, имитирующий api.telegram.org на 127.0.0.1"""
+
+    def __init__(self, max_connections: int = 40, latency: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1):
+        self.max_connections = max_connections
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.floods = 0
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._injected_at = {}
+        self.latencies = []
+        self.webhook_url = None
+        self.secret_token = None
+        self.replies = 0
+        self._done = asyncio.Event()
+        self._expected = 0
+        # Неотвеченные метки по чатам во время play() (None - считаем просто ответы)
+        self._open = None
+        self._last_reply_at = 0.0
+        self._runner = None
+        self._session = None
+        self._webhook_tasks = set()
+        self._webhook_slots = None
+        self.url = None
+
+    @property
+    def base_url(self) -> str:
+        """base_url для ApplicationBuilder (к нему дописывается токен)"""
+        return f'{self.url}/bot'
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        self._webhook_slots = asyncio.Semaphore(self.max_connections)
+        return self.url
+
+    async def stop(self):
+        for task in list(self._webhook_tasks):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def reset(self, expected: int):
+        """Новый замер: ждать expected ответов бота"""
+        self.latencies = []
+        self.replies = 0
+        self._expected = expected
+        self._done = asyncio.Event()
+
+    async def wait_replies(self, timeout: float = 120):
+        await asyncio.wait_for(self._done.wait(), timeout)
+
+    async def play(self, messages: list[tuple[int, str]], rate: float | None = None,
+                   settle: float = 2.0) -> dict:
+        """
+        Сценарий (user_id, текст) разом или rate сообщений в секунду; ждёт ответа
+        на каждое сообщение. Метка #<номер> дописывается к тексту сама.
+
+        Бот склеивает быстрые сообщения пользователя в одну реплику: ответ AI
+        закрывает все свои метки, ответ без меток (/start, лимит, антиспам) -
+        самое старое неотвеченное сообщение чата. Отказ на склейку закрывает
+        лишь одно из её сообщений, поэтому после settle секунд без ответов
+        прогон заканчивается, остаток попадает в unanswered. elapsed - до
+        последнего ответа, без этой паузы.
+        """
+        self.reset(len(messages))
+        self.floods = 0
+        self._open = {}
+        started = self._last_reply_at = time.perf_counter()
+        for mark, (user_id, text) in enumerate(messages, start=self._next_update_id):
+            self._open.setdefault(user_id, deque()).append(str(mark))
+            self.inject(user_id, f'{text} #{mark}')
+            if rate:
+                await asyncio.sleep(1 / rate)
+        while self._open:
+            quiet = time.perf_counter() - self._last_reply_at
+            if quiet >= settle:
+                break
+            try:
+                await asyncio.wait_for(self._done.wait(), settle - quiet)
+            except asyncio.TimeoutError:
+                pass
+        unanswered = sum(len(marks) for marks in self._open.values())
+        self._open = None
+        return {
+            'elapsed': self._last_reply_at - started,
+            'replies': self.replies,
+            'latencies': self.latencies,
+            'floods': self.floods,
+            'unanswered': unanswered,
+        }
+
+    def _answer(self, chat_id: int, marks: list[str]):
+        """Ответ в чат закрывает свои метки или, без меток, самое старое сообщение"""
+        pending = self._open.get(chat_id)
+        if not pending:
+            return
+        if marks:
+            for mark in marks:
+                if mark in pending:
+                    pending.remove(mark)
+        else:
+            pending.popleft()
+        if not pending:
+            del self._open[chat_id]
+
+    def inject(self, user_id: int, text: str):
+        """Новое сообщение пользователя; в тексте должна быть метка #<номер>"""
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        update = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+                'text': text,
+            },
+        }
+        if text.startswith('/'):
+            # Как настоящий Telegram: команда размечена entity, иначе PTB считает её текстом
+            command = text.split(maxsplit=1)[0]
+            update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        self._injected_at[MARK.search(text).group(1)] = time.perf_counter()
+        if self.webhook_url:
+            task = asyncio.create_task(self._deliver(update))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+
+    async def _deliver(self, update: dict):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.secret_token or ''}
+        async with self._webhook_slots:
+            async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+                await response.read()
+
+    async def params(self, request: web.Request) -> dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        data = dict(await request.post())
+        for key, value in data.items():
+            try:
+                data[key] = json.loads(value)
+            except (TypeError, ValueError):
+                pass
+        return data
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self.params(request)
+        handler = getattr(self, f'api_{method}', None)
+        if method != 'getUpdates' and self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'sendMessage' and self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+        return web.json_response({'ok': True, 'result': await handler(params)})
+
+    async def api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def api_deleteWebhook(self, params: dict):
+        self.webhook_url = None
+        return True
+
+    async def api_setWebhook(self, params: dict):
+        self.webhook_url = params['url']
+        self.secret_token = params.get('secret_token')
+        return True
+
+    async def api_getUpdates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self._updates[:limit]
+
+    async def api_sendMessage(self, params: dict):
+        text = str(params.get('text', ''))
+        chat_id = int(params['chat_id'])
+        now = self._last_reply_at = time.perf_counter()
+        marks = MARK.findall(text)
+        for mark in marks:
+            if mark in self._injected_at:
+                self.latencies.append(now - self._injected_at.pop(mark))
+        self.replies += 1
+        if self._open is not None:
+            self._answer(chat_id, marks)
+            if not self._open:
+                self._done.set()
+        elif self.replies >= self._expected:
+            self._done.set()
+        return {
+            'message_id': self.replies,
+            'date': int(datetime.now(timezone.utc).timestamp()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': text,
+        }
@@ -0,0 +1,183 @@
+"""
+Локальный mock ProxyAPI (chat/completions) для бенчмарков.
+
+Отвечает фиксированным ответом: latency - задержка до первого токена,
+token_delay - пауза на каждый следующий токен (слово). Поддерживает
+stream: true в формате SSE как у OpenAI. Для проверки устойчивости умеет
+отвечать ошибками: error_rate - доля случайных ошибок error_status,
+fail_next(...) - заданная последовательность статусов. Считает различные
+клиентские TCP соединения, чтобы было видно переиспользование keep-alive.
+Кэш префикса имитируется как у OpenAI: повторный системный промпт
+возвращается в usage.prompt_tokens_details.cached_tokens. С echo_mark ответ
+заканчивается меткой "#<номер>" из последнего сообщения пользователя - так
+fake Telegram меряет задержку полного цикла через бота.
+"""
+
+import asyncio
+import json
+import random
+import re
+
+from aiohttp import web
+
+MARK = re.compile(r'#\d+')
+REPLY = 'Слабак, но чинится. План:\n\n1. Встал в 7:00\n2. Пробежал 2 км\n3. Отписался\n\nНе сделал - пиздабол.'
+
+
+class MockProxyAPI:
+    """aiohttp сервер, имитирующий ProxyAPI на 127.0.0.1"""
+
+    def __init__(self, latency: float = 0.0, reply: str = REPLY, token_delay: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, retry_after: float | None = None,
+                 echo_mark: bool = False):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self._scripted = []
+        self.errors = 0
+        self.reply = reply
+        self.echo_mark = echo_mark
+        self.requests = 0
+        self._peers = set()
+        self._prefixes = set()
+        self._runner = None
+        self.url = None
+
+    @property
+    def connections(self) -> int:
+        """Количество разных клиентских соединений (host, port)"""
+        return len(self._peers)
+
+    def fail_next(self, *statuses: int):
+        """Следующие запросы получат указанные статусы по порядку"""
+        self._scripted.extend(statuses)
+
+    def _pick_error(self) -> int | None:
+        if self._scripted:
+            return self._scripted.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def reset(self):
+        self.requests = 0
+        self._peers.clear()
+
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        self._peers.add(request.transport.get_extra_info('peername'))
+        body = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status = self._pick_error()
+        if status is not None and status != 200:
+            self.errors += 1
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+            return web.json_response({'error': {'message': 'mock failure', 'code': status}},
+                                     status=status, headers=headers)
+        usage = self.usage(body)
+        reply = self.reply_for(body)
+        if body.get('stream'):
+            include_usage = (body.get('stream_options') or {}).get('include_usage')
+            return await self.stream_completion(request, reply, usage if include_usage else None)
+        if self.token_delay:
+            await asyncio.sleep(self.token_delay * len(self.tokens(reply)))
+        return web.json_response(self.completion(reply, usage=usage))
+
+    def reply_for(self, body: dict) -> str:
+        if not self.echo_mark:
+            return self.reply
+        for message in reversed(body.get('messages') or []):
+            if message.get('role') == 'user':
+                marks = MARK.findall(message.get('content', ''))
+                return f'{self.reply} {" ".join(marks)}' if marks else self.reply
+        return self.reply
+
+    def usage(self, body: dict) -> dict:
+        """usage с грубым подсчётом токенов; повторный префикс считается закэшированным"""
+        messages = body.get('messages') or []
+        prompt_tokens = sum(len(m.get('content', '')) // 3 + 4 for m in messages)
+        prefix = messages[0].get('content', '') if messages else ''
+        prefix_tokens = len(prefix) // 3 + 4
+        cached = 0
+        if prefix_tokens >= 1024:
+            if prefix in self._prefixes:
+                cached = prefix_tokens // 128 * 128
+            self._prefixes.add(prefix)
+        completion_tokens = len(self.tokens(self.reply))
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached},
+            'completion_tokens_details': {'reasoning_tokens': 0},
+        }
+
+    @staticmethod
+    def tokens(content: str) -> list[str]:
+        """Грубое деление ответа на токены: слово вместе с пробелом после него"""
+        words = content.split(' ')
+        return [word + ' ' for word in words[:-1]] + words[-1:]
+
+    async def stream_completion(self, request: web.Request, content: str,
+                                usage: dict | None = None) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for i, token in enumerate(self.tokens(content)):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            chunk = {'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode())
+        final = {'object': 'chat.completion.chunk',
+                 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        await response.write(f'data: {json.dumps(final)}\n\n'.encode())
+        if usage is not None:
+            tail = {'object': 'chat.completion.chunk', 'choices': [], 'usage': usage}
+            await response.write(f'data: {json.dumps(tail)}\n\n'.encode())
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def completion(content: str, finish_reason: str = 'stop', usage: dict | None = None) -> dict:
+        return {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': finish_reason
+            }],
+            'usage': usage or {'prompt_tokens': 1500, 'completion_tokens': 120, 'total_tokens': 1620}
+        }
+
+    async def start(self, port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.handle_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/v1/chat/completions'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def main():
+    mock = MockProxyAPI()
+    url = await mock.start(8765)
+    print(f'Mock ProxyAPI: {url}')
+    print(json.dumps(mock.completion('пример'), ensure_ascii=False))
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+Склейка пачки сообщений пользователя в одну реплику.
+
+Пользователи часто пишут одну мысль тремя-четырьмя быстрыми сообщениями.
+Апдейты одного пользователя обрабатываются по очереди, поэтому пока первое
+сообщение ждёт окно тишины (или пока идёт запрос к AI), следующие стоят в
+его очереди. Процессор апдейтов сообщает о каждом пришедшем тексте (note),
+хендлер первого сообщения забирает стоящие за ним тексты (collect) - один
+запрос к AI и одно списание лимита. Забранные сообщения, когда до них дойдёт
+очередь, просто пропускаются (absorbed).
+
+Окно тишины ждётся в settle - процессор вызывает его, когда подошла очередь
+пользователя, но до того, как апдейт займёт слот обработчика: ожидание
+конца пачки держит только очередь самого пользователя.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+
+class PendingText:
+    """Текстовое сообщение, ждущее своей очереди"""
+    __slots__ = ('chat_id', 'message_id', 'text', 'arrived_at')
+
+    def __init__(self, chat_id: int, message_id: int, text: str, arrived_at: float):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.arrived_at = arrived_at
+
+
+class MessageCoalescer:
+    """Окно тишины на пользователя и склейка очереди его текстов"""
+
+    def __init__(self, message_filter, window: float = 1.0, max_wait: float = 4.0, max_messages: int = 5):
+        # Какие апдейты склеиваются (тот же фильтр, что у хендлера текстов)
+        self.message_filter = message_filter
+        # Сколько ждать тишины после последнего сообщения пачки; 0 - не ждать
+        self.window = window
+        # Дольше max_wait от первого сообщения не ждём, даже если пишут без пауз
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._pending = {}
+        self._absorbed = set()
+        self.turns = 0
+        self.merged = 0
+
+    def note(self, user_id: int, update):
+        """Апдейт пришёл и встал в очередь пользователя (вызывается процессором)"""
+        if not self.message_filter.check_update(update):
+            return
+        message = update.effective_message
+        queue = self._pending.get(user_id)
+        if queue is None:
+            queue = self._pending[user_id] = deque()
+        queue.append(PendingText(message.chat_id, message.message_id, message.text, time.monotonic()))
+
+    def absorbed(self, message) -> bool:
+        """Сообщение уже склеено с предыдущим - обрабатывать не нужно"""
+        key = (message.chat_id, message.message_id)
+        if key in self._absorbed:
+            self._absorbed.discard(key)
+            return True
+        return False
+
+    async def settle(self, user_id: int, update):
+        """
+        Ожидание, пока пользователь не замолчит на window секунд (не дольше
+        max_wait от сообщения). Вызывается процессором до занятия слота; для
+        апдейтов, которых нет в очереди текстов (команды, склеенные), не ждёт.
+        """
+        queue = self._pending.get(user_id)
+        message = update.effective_message
+        if self.window <= 0 or not queue or message is None:
+            return
+        for entry in queue:
+            if entry.chat_id == message.chat_id and entry.message_id == message.message_id:
+                break
+        else:
+            return
+
+        deadline = entry.arrived_at + self.max_wait
+        while len(queue) < self.max_messages:
+            delay = min(queue[-1].arrived_at + self.window, deadline) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+    def collect(self, user_id: int, message) -> str:
+        """Текст реплики: само сообщение плюс стоящие за ним в очереди тексты"""
+        self.turns += 1
+        queue = self._pending.get(user_id)
+        if queue is None:
+            return message.text
+
+        # Снимаем своё сообщение (и всё, что почему-то осталось перед ним)
+        while queue:
+            entry = queue.popleft()
+            if entry.chat_id == message.chat_id and entry.message_id == message.message_id:
+                break
+
+        parts = [message.text]
+        while queue and len(parts) < self.max_messages:
+            entry = queue.popleft()
+            self._absorbed.add((entry.chat_id, entry.message_id))
+            parts.append(entry.text)
+        if not queue:
+            del self._pending[user_id]
+        self.merged += len(parts) - 1
+        return '\n'.join(parts)
+
+    def stats(self) -> dict:
+        """Сколько реплик собрано и сколько сообщений в них вклеено"""
+        return {
+            'turns': self.turns,
+            'merged': self.merged,
+            'waiting': sum(len(queue) for queue in self._pending.values()),
+        }
@@ -0,0 +1,95 @@
+"""
+Сборка контекста запроса к AI в пределах бюджета входных токенов.
+
+Токены считаются откалиброванной оценкой без сетевых зависимостей:
+кириллица в токенизаторах GPT дороже латиницы, плюс служебные токены на
+каждое сообщение. Последние сообщения берутся, пока влезают в бюджет;
+всё, что не влезло, позже сжимается в краткое содержание (summary).
+
+Порядок сообщений рассчитан на кэш префикса у upstream: сначала общий для
+всех системный промпт (байт в байт одинаковый), потом всё персональное.
+"""
+
+import hashlib
+import re
+from collections import deque
+from functools import lru_cache
+
+from quantiles import percentile
+
+# Калибровка оценки: средние значения для токенизаторов GPT (o200k_base)
+CHARS_PER_TOKEN_CYRILLIC = 3.0
+CHARS_PER_TOKEN_OTHER = 4.0
+TOKENS_PER_MESSAGE = 4
+
+# Кириллица считается целыми отрезками: в разы быстрее прохода по символам
+CYRILLIC_RUN = re.compile('[\u0400-\u04ff]+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка количества токенов в тексте"""
+    cyrillic = sum(map(len, CYRILLIC_RUN.findall(text)))
+    other = len(text) - cyrillic
+    return int(cyrillic / CHARS_PER_TOKEN_CYRILLIC + other / CHARS_PER_TOKEN_OTHER) + 1
+
+
+def estimate_message_tokens(text: str) -> int:
+    """Оценка токенов сообщения вместе со служебными"""
+    return estimate_tokens(text) + TOKENS_PER_MESSAGE
+
+
+@lru_cache(maxsize=16)
+def prompt_cache_key(system_prompt: str) -> str:
+    """Стабильный ключ кэша префикса: одинаковый для всех запросов с этим промптом"""
+    return 'tyler-' + hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]
+
+
+class ContextWindow:
+    """Окно контекста: системный промпт + summary + последние сообщения в бюджете"""
+
+    def __init__(self, system_message: dict, token_budget: int = 8000):
+        self.system_message = system_message
+        self.system_tokens = estimate_message_tokens(system_message['content'])
+        self.token_budget = token_budget
+        # Распределение входных токенов: вся история против отправленного окна
+        self.full_tokens = deque(maxlen=1000)
+        self.sent_tokens = deque(maxlen=1000)
+
+    def build(self, history) -> tuple[list[dict], int]:
+        """
+        Сообщения для API и количество старых сообщений, не вошедших в окно.
+        Самое последнее сообщение входит всегда, даже сверх бюджета.
+        """
+        turns = list(history)
+        summary_message = None
+        used = self.system_tokens
+        if history.summary:
+            summary_message = {'role': 'system', 'content': f'Краткое содержание ранней части диалога:\n{history.summary}'}
+            used += estimate_message_tokens(summary_message['content'])
+
+        full = used + sum(turn.tokens for turn in turns)
+        selected = 0
+        for turn in reversed(turns):
+            if selected and used + turn.tokens > self.token_budget:
+                break
+            used += turn.tokens
+            selected += 1
+
+        self.full_tokens.append(full)
+        self.sent_tokens.append(used)
+
+        messages = [self.system_message]
+        if summary_message:
+            messages.append(summary_message)
+        messages.extend(turn.to_message() for turn in turns[len(turns) - selected:])
+        return messages, len(turns) - selected
+
+    def stats(self) -> dict:
+        """Перцентили входных токенов без окна и с окном"""
+        return {
+            'budget': self.token_budget,
+            'full_p50': percentile(self.full_tokens, 0.5),
+            'full_p95': percentile(self.full_tokens, 0.95),
+            'sent_p50': percentile(self.sent_tokens, 0.5),
+            'sent_p95': percentile(self.sent_tokens, 0.95),
+        }
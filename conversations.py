@@ -0,0 +1,253 @@
+"""
+Хранилище истории диалогов.
+
+Истории лежат в таблице conversations и подгружаются при первом сообщении
+пользователя. В памяти держится не больше max_resident диалогов (LRU),
+изменения копятся и пишутся в БД пачками раз в flush_interval секунд.
+Вытесненный из памяти изменённый диалог ждёт ближайшего сброса в _pending.
+
+История пользователя - ChatHistory: кольцевой буфер компактных Turn без
+системного промпта. Промпт общий и добавляется только при сборке запроса.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from context import estimate_message_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """Одно сообщение диалога с оценкой его размера в токенах"""
+    __slots__ = ('role', 'content', '_tokens')
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self._tokens = None
+
+    @property
+    def tokens(self) -> int:
+        # Оценка считается при первой сборке контекста, а не на каждом append и загрузке
+        if self._tokens is None:
+            self._tokens = estimate_message_tokens(self.content)
+        return self._tokens
+
+    def to_message(self) -> dict:
+        return {'role': self.role, 'content': self.content}
+
+
+class ChatHistory:
+    """
+    Кольцевой буфер последних capacity сообщений.
+    append - O(1): при заполнении перезаписывается самое старое сообщение.
+    summary - краткое содержание сообщений, уже убранных из буфера.
+    version растёт при каждом изменении (по нему сброс в БД видит правки во время записи).
+    """
+    __slots__ = ('capacity', '_turns', '_start', 'summary', 'version')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._turns = []
+        self._start = 0
+        self.summary = ''
+        self.version = 0
+
+    def __len__(self):
+        return len(self._turns)
+
+    def __iter__(self):
+        """Сообщения от старых к новым"""
+        turns = self._turns
+        for i in range(len(turns)):
+            yield turns[(self._start + i) % len(turns)]
+
+    def append(self, role: str, content: str):
+        turn = Turn(role, content)
+        if len(self._turns) < self.capacity:
+            self._turns.append(turn)
+        else:
+            self._turns[self._start] = turn
+            self._start = (self._start + 1) % self.capacity
+        self.version += 1
+
+    def oldest(self, count: int) -> list[Turn]:
+        """count самых старых сообщений"""
+        return list(self)[:count]
+
+    def compact(self, turns: list[Turn], summary: str):
+        """
+        Замена сжатых сообщений на summary. Убираются только те из turns,
+        что всё ещё лежат в начале буфера (буфер мог сдвинуться за время сжатия).
+        Сравнение по роли и тексту: история могла быть вытеснена и загружена
+        заново, и объекты Turn уже другие.
+        """
+        remaining = list(self)
+        compacted = [(turn.role, turn.content) for turn in turns]
+        # Самый длинный хвост turns, с которого начинается буфер
+        for start in range(len(compacted)):
+            tail = compacted[start:]
+            if [(turn.role, turn.content) for turn in remaining[:len(tail)]] == tail:
+                remaining = remaining[len(tail):]
+                break
+        self._turns = remaining
+        self._start = 0
+        self.summary = summary
+        self.version += 1
+
+    def load(self, data):
+        """Загрузка из JSON: список сообщений или {'summary': ..., 'messages': [...]}"""
+        if isinstance(data, dict):
+            self.summary = data.get('summary', '')
+            data = data.get('messages', [])
+        self.extend(data)
+
+    def extend(self, messages: list[dict]):
+        """Добавление сообщений в формате API (системные пропускаются)"""
+        for message in messages:
+            if message.get('role') != 'system':
+                self.append(message['role'], message['content'])
+
+    def to_messages(self, system_message: dict | None = None) -> list[dict]:
+        """Список сообщений для API; system_message (общий) ставится первым"""
+        messages = [system_message] if system_message else []
+        messages.extend(turn.to_message() for turn in self)
+        return messages
+
+    def to_json(self) -> str:
+        if self.summary:
+            return json.dumps({'summary': self.summary, 'messages': self.to_messages()}, ensure_ascii=False)
+        return json.dumps(self.to_messages(), ensure_ascii=False)
+
+
+class ConversationStore:
+    """LRU набор историй в памяти поверх таблицы conversations"""
+
+    def __init__(self, storage, new_history, max_resident: int = 5000, flush_interval: float = 5.0):
+        self.storage = storage
+        # Фабрика пустой истории (ChatHistory)
+        self.new_history = new_history
+        self.max_resident = max_resident
+        self.flush_interval = flush_interval
+        self._resident = OrderedDict()
+        self._dirty = set()
+        self._pending = {}
+        self._flush_task = None
+        self.loads = 0
+        self.evictions = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._resident)
+
+    async def start(self):
+        """Запуск фонового сброса изменений в БД"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Остановка фонового сброса и финальная запись всех изменений"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f'Не удалось сохранить истории диалогов: {e}')
+
+    async def get(self, user_id: int) -> ChatHistory:
+        """История пользователя; при первом обращении загружается из БД"""
+        history = self._resident.get(user_id)
+        if history is not None:
+            self._resident.move_to_end(user_id)
+            return history
+
+        # Вытесненная, но ещё не сохранённая история возвращается в память
+        history = self._pending.pop(user_id, None)
+        if history is not None:
+            self._store(user_id, history)
+            self._dirty.add(user_id)
+            return history
+
+        messages = await self.storage.load_conversation(user_id)
+        # Пока ждали БД, историю мог загрузить параллельный запрос
+        if user_id in self._resident or user_id in self._pending:
+            return await self.get(user_id)
+        history = self.new_history()
+        if messages:
+            history.load(json.loads(messages))
+        self.loads += 1
+
+        self._store(user_id, history)
+        return history
+
+    def peek(self, user_id: int) -> ChatHistory | None:
+        """История из памяти без загрузки из БД и без обновления LRU"""
+        history = self._resident.get(user_id)
+        return history if history is not None else self._pending.get(user_id)
+
+    def mark_dirty(self, user_id: int):
+        """История изменена на месте и должна попасть в ближайший сброс"""
+        self._dirty.add(user_id)
+
+    def _store(self, user_id: int, history: ChatHistory):
+        self._resident[user_id] = history
+        self._resident.move_to_end(user_id)
+        while len(self._resident) > self.max_resident:
+            evicted_id, evicted = self._resident.popitem(last=False)
+            self.evictions += 1
+            if evicted_id in self._dirty:
+                self._dirty.discard(evicted_id)
+                self._pending[evicted_id] = evicted
+
+    async def flush(self):
+        """Запись всех изменённых историй одной транзакцией"""
+        if not self._dirty and not self._pending:
+            return
+        batch = dict(self._pending)
+        for user_id in self._dirty:
+            batch[user_id] = self._resident[user_id]
+        self._dirty.clear()
+
+        # Версии на момент снимка: история, изменённая во время записи, остаётся в очереди
+        versions = {user_id: history.version for user_id, history in batch.items()}
+        now = int(time.time())
+        rows = [(user_id, history.to_json(), now) for user_id, history in batch.items()]
+        try:
+            await self.storage.save_conversations(rows)
+        except Exception:
+            # Вернём в очередь на следующий сброс
+            for user_id, history in batch.items():
+                if user_id in self._resident:
+                    self._dirty.add(user_id)
+                else:
+                    self._pending.setdefault(user_id, history)
+            raise
+        for user_id, history in batch.items():
+            if self._pending.get(user_id) is history and history.version == versions[user_id]:
+                del self._pending[user_id]
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        """Размер рабочего набора и счётчики загрузок/вытеснений"""
+        return {
+            'resident': len(self._resident),
+            'dirty': len(self._dirty),
+            'pending': len(self._pending),
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'flushes': self.flushes,
+        }
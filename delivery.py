@@ -0,0 +1,154 @@
+"""
+Исходящие запросы к Telegram Bot API.
+
+FloodLimiter подключается к Application как rate limiter python-telegram-bot,
+поэтому через него проходит всё, что отправляют хендлеры: reply_text,
+правки стрима, инвойсы. Отправка выравнивается двумя ведрами токенов:
+общим на бота (~30 сообщений/сек) и своим на каждый чат (личка ~1/сек,
+группы ~20/мин). Если Telegram всё же ответил RetryAfter - чат ставится
+на паузу и запрос тихо повторяется, хендлер ошибку не видит.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from quantiles import percentile
+from ratelimit import RateMeter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые отправляют сообщение в чат (sendChatAction - только индикатор набора)
+MESSAGE_ENDPOINTS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendAudio', 'sendVideo', 'sendAnimation', 'sendVoice',
+    'sendVideoNote', 'sendSticker', 'sendMediaGroup', 'sendLocation', 'sendVenue', 'sendContact',
+    'sendPoll', 'sendDice', 'sendInvoice', 'copyMessage', 'forwardMessage',
+})
+
+
+class FloodLimiter(BaseRateLimiter):
+    """Глобальное и per-chat ведро токенов + прозрачные повторы RetryAfter"""
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 group_rate: float = 20 / 60, max_retries: int = 3, max_retry_after: float = 60,
+                 idle_sweep: int = 8, meter: RateMeter | None = None, on_sent=None):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        # Паузу длиннее этой не ждём - ошибка уходит хендлеру
+        self.max_retry_after = max_retry_after
+        self.idle_sweep = idle_sweep
+        # Счётчик отправленных сообщений (для /stats)
+        self.meter = meter or RateMeter(60)
+        # on_sent(секунды) после каждого отправленного сообщения, с ожиданием очереди (метрики)
+        self.on_sent = on_sent
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = OrderedDict()
+        self._latencies = deque(maxlen=1000)
+        self.waiting = 0
+        self.max_waiting = 0
+        self.sent = 0
+        self.retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id: int | str, now: float) -> TokenBucket:
+        chats = self._chats
+        # Снимаем с головы несколько давно молчащих чатов
+        for _ in range(self.idle_sweep):
+            if not chats:
+                break
+            head_id, head = next(iter(chats.items()))
+            if head_id == chat_id or not head.idle(now):
+                break
+            del chats[head_id]
+
+        bucket = chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id или @username - группа/канал
+            group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            bucket = chats[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        else:
+            chats.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_turn(self, chat_id, retry_after: float = 0.0):
+        """
+        Очередь сначала в своём чате, потом в общем ведре. Повтор после
+        RetryAfter своё место в чате не теряет: ждёт паузу и идёт без очереди чата.
+        """
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            if retry_after:
+                await asyncio.sleep(retry_after)
+            else:
+                delay = self._chat_bucket(chat_id, time.monotonic()).reserve(time.monotonic())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            delay = self._global.reserve(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # Ответы на callback/pre-checkout и служебные запросы - без очереди
+            return await callback(*args, **kwargs)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        started = time.monotonic()
+        attempt = 0
+        retry_after = 0.0
+        while True:
+            await self._wait_turn(chat_id, retry_after)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                attempt += 1
+                self.retries += 1
+                logger.warning(f'Telegram RetryAfter {e.retry_after} сек для чата {chat_id} ({endpoint}), '
+                               f'повтор {attempt}/{self.max_retries}')
+                retry_after = e.retry_after
+                self._chat_bucket(chat_id, time.monotonic()).block(time.monotonic() + retry_after)
+                continue
+            break
+
+        elapsed = time.monotonic() - started
+        self._latencies.append(elapsed)
+        if endpoint in MESSAGE_ENDPOINTS:
+            self.sent += 1
+            self.meter.record()
+            if self.on_sent is not None:
+                self.on_sent(elapsed)
+        return result
+
+    def stats(self) -> dict:
+        """Глубина очереди на отправку и время отправки"""
+        return {
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'retries': self.retries,
+            'latency_p50': percentile(self._latencies, 0.5),
+            'latency_p95': percentile(self._latencies, 0.95),
+        }
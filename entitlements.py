@@ -0,0 +1,98 @@
+"""
+Кэш прав пользователей: дата окончания премиума и счётчик запросов за день.
+
+Премиум меняется только при оплате, счётчик - только когда мы сами логируем
+запрос, поэтому кэш работает как write-through и для горячих пользователей
+проверка лимита обходится без обращения к БД. Смена суток по МСК сбрасывает
+счётчик лениво: запись помнит день, к которому относится.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+
+class Reservation(NamedTuple):
+    """Зарезервированный слот запроса: пользователь, время строки request_logs и день МСК"""
+    user_id: int
+    ts: int
+    day: str
+
+
+class Entitlement:
+    """Права пользователя на конкретный день"""
+    __slots__ = ('premium_until', 'day', 'used')
+
+    def __init__(self, premium_until: datetime | None, day: str, used: int):
+        self.premium_until = premium_until
+        self.day = day
+        self.used = used
+
+
+class EntitlementCache:
+    """LRU кэш прав с ограниченным размером и счётчиками попаданий"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id: int, day: str) -> Entitlement | None:
+        """Запись пользователя на день day или None, если её нет в кэше"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        if entry.day != day:
+            # Наступили новые сутки по МСК - счётчик начинается заново
+            entry.day = day
+            entry.used = 0
+        self.hits += 1
+        return entry
+
+    def put(self, user_id: int, premium_until: datetime | None, day: str, used: int) -> Entitlement:
+        """Сохранение загруженных из БД прав"""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.day == day:
+            # Параллельная загрузка могла принести устаревший счётчик
+            used = max(used, entry.used)
+        entry = Entitlement(premium_until, day, used)
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def set_premium(self, user_id: int, premium_until: datetime):
+        """Write-through после оплаты"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.premium_until = premium_until
+
+    def add_used(self, user_id: int, day: str, delta: int = 1):
+        """Write-through после логирования (+1) или возврата (-1) запроса"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if entry.day != day:
+            if delta < 0:
+                # Возвращаемый слот относился к прошлым суткам
+                return
+            entry.day = day
+            entry.used = 0
+        entry.used = max(0, entry.used + delta)
+
+    def stats(self) -> dict:
+        """Размер кэша и счётчики попаданий"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
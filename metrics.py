@@ -0,0 +1,161 @@
+"""
+Метрики конвейера обработки в текстовом формате Prometheus.
+
+Без prometheus_client: нужны лишь гистограммы, счётчики и гауджи, а всё
+работает в одном event loop, поэтому блокировки не нужны. observe() у
+гистограммы - bisect по границам корзин и два сложения, inc() у счётчика -
+одно сложение. Гауджи - функции, которые вызываются только при запросе
+/metrics, на горячем пути они не стоят ничего.
+
+Отдаются на локальном порту (GET /metrics); при нескольких воркерах у
+каждого свой порт.
+"""
+
+import logging
+from bisect import bisect_left
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин в секундах: от проверки в памяти до долгого ответа AI
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class HistogramSeries:
+    """Корзины одной серии гистограммы (не накопительные до выдачи)"""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Гистограмма с одной меткой: observe('db_gate', 0.003)"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.bounds = tuple(buckets)
+        self._series = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = HistogramSeries(len(self.bounds) + 1)
+        # Последняя корзина - всё, что больше верхней границы (+Inf)
+        series.counts[bisect_left(self.bounds, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_value, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{_format(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {_format(series.sum)}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {series.count}')
+        return lines
+
+
+class Counter:
+    """Счётчик с одной меткой: inc('empty_content')"""
+
+    def __init__(self, name: str, help_text: str, label: str, values: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        # Заранее известные значения метки отдаются нулями до первого события
+        self._values = dict.fromkeys(values, 0)
+
+    def inc(self, label_value: str, amount: int = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_value, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Gauge:
+    """Значение, читаемое функцией в момент выдачи метрик"""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge',
+                f'{self.name} {_format(self.read())}']
+
+
+class Metrics:
+    """Реестр метрик и их выдача одним текстом"""
+
+    def __init__(self, prefix: str = 'tyler'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def histogram(self, name: str, help_text: str, label: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(f'{self.prefix}_{name}', help_text, label, buckets))
+
+    def counter(self, name: str, help_text: str, label: str, values: tuple = ()) -> Counter:
+        return self._add(Counter(f'{self.prefix}_{name}', help_text, label, values))
+
+    def gauge(self, name: str, help_text: str, read) -> Gauge:
+        return self._add(Gauge(f'{self.prefix}_{name}', help_text, read))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Сломанный гаудж не должен ронять выдачу остальных метрик
+                logger.error(f'Метрика {metric.name} не отдана: {e}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """GET /metrics на локальном aiohttp сервере"""
+
+    def __init__(self, metrics: Metrics, listen: str = '127.0.0.1', port: int = 9100):
+        self.metrics = metrics
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f'Метрики: http://{self.listen}:{self.port}/metrics')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), headers={'Content-Type': CONTENT_TYPE})
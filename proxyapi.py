@@ -0,0 +1,280 @@
+"""
+HTTP клиент ProxyAPI.
+
+Одна ClientSession на всё время работы бота: соединения с api.proxyapi.ru
+переиспользуются (keep-alive), DNS кэшируется, TLS рукопожатие делается
+один раз на соединение, а не на каждый запрос к AI.
+
+Поверх пула - устойчивость: ошибки классифицируются, временные (429, 5xx,
+таймауты, обрывы) повторяются с экспоненциальной задержкой и jitter с учётом
+Retry-After, а circuit breaker перестаёт долбить лежащий upstream и
+периодически пробует его одним запросом (half-open).
+
+Таймауты: запрос без стрима ограничен total_timeout, стрим - паузой между
+кусками (read_timeout), а не общей длиной: длинная генерация не обрывается,
+пока текст идёт. Все попытки одного запроса вместе укладываются в deadline.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ProxyAPIError(Exception):
+    """Ошибка запроса к ProxyAPI"""
+
+    def __init__(self, message: str, status: int | None = None,
+                 retryable: bool = False, retry_after: float | None = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ProxyAPIError):
+    """Upstream признан нездоровым, запрос не отправлялся"""
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After в секундах (число или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_response(status: int, body: str, headers) -> ProxyAPIError:
+    """Ошибка по HTTP ответу upstream"""
+    return ProxyAPIError(
+        f'ProxyAPI ответил {status}: {body[:500]}',
+        status=status,
+        retryable=status in RETRYABLE_STATUSES,
+        retry_after=parse_retry_after(headers.get('Retry-After'))
+    )
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Экспоненциальная задержка с full jitter для попытки attempt (с 0)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    closed -> open после failure_threshold подряд неудач;
+    open -> half_open через reset_timeout, пропускается один пробный запрос;
+    успех пробы закрывает цепь, неудача снова открывает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        """Разрешение на запрос; CircuitOpenError если цепь разомкнута"""
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN:
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError('ProxyAPI недоступен (circuit open)', retry_after=retry_in)
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            raise CircuitOpenError('ProxyAPI проверяется пробным запросом (half-open)')
+        self._probe_in_flight = True
+
+    def release_probe(self):
+        """Пробный запрос завершился без вердикта о здоровье upstream"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info('ProxyAPI снова отвечает, circuit закрыт')
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.error(f'ProxyAPI нездоров ({self.failures} ошибок подряд), circuit открыт '
+                             f'на {self.reset_timeout:.0f} сек')
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProxyAPIClient:
+    """Пул соединений к ProxyAPI с явными таймаутами"""
+
+    def __init__(self, url: str, api_key: str, max_connections: int = 20,
+                 total_timeout: float = 120, connect_timeout: float = 10,
+                 read_timeout: float = 60, deadline: float = 300,
+                 keepalive_timeout: float = 60, dns_cache_ttl: int = 300,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 breaker: CircuitBreaker | None = None):
+        self.url = url
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+        # Стрим: сколько ждать следующего куска; deadline - на все попытки вместе
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.failures = 0
+        self._session = None
+        self._stream_timeout = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создаётся в start()"""
+        if self._session is None:
+            raise RuntimeError('ProxyAPIClient не запущен')
+        return self._session
+
+    async def start(self):
+        """Создание сессии и пула соединений (вызывается из post_init)"""
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            connect=self.connect_timeout,
+            sock_connect=self.connect_timeout,
+        )
+        self._stream_timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json'
+            }
+        )
+        logger.info(f'Пул соединений ProxyAPI: до {self.max_connections} соединений')
+
+    async def close(self):
+        """Закрытие сессии (вызывается из post_shutdown)"""
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+
+    def post(self, data: dict, **kwargs):
+        """POST запрос к chat/completions через общую сессию (стрим - с таймаутом простоя)"""
+        if data.get('stream'):
+            kwargs.setdefault('timeout', self._stream_timeout)
+        return self.session.post(self.url, json=data, **kwargs)
+
+    async def execute(self, request, can_retry=None):
+        """
+        Выполнение request() через circuit breaker с повторами временных ошибок.
+        request - корутинная функция без аргументов; can_retry() - можно ли
+        повторять (например, пока пользователю ещё ничего не показано).
+        Попытки вместе с паузами между ними укладываются в self.deadline.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                async with asyncio.timeout_at(deadline):
+                    result = await request()
+            except ProxyAPIError as e:
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = ProxyAPIError(f'Сетевая ошибка ProxyAPI: {e!r}', retryable=True)
+            except BaseException:
+                # Ошибка не upstream'а (отмена, сбой отправки в Telegram) - без вердикта
+                self.breaker.release_probe()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            if error.retryable:
+                self.breaker.record_failure()
+                self.failures += 1
+            else:
+                # Upstream ответил, просто запрос плохой - здоровье не страдает
+                self.breaker.record_success()
+                raise error
+
+            delay = max(backoff_delay(attempt, self.backoff_base, self.backoff_cap), error.retry_after or 0)
+            if (attempt >= self.max_retries
+                    or loop.time() + delay >= deadline
+                    or self.breaker.state == CircuitBreaker.OPEN
+                    or delay > self.backoff_cap * 2
+                    or (can_retry is not None and not can_retry())):
+                raise error
+
+            attempt += 1
+            self.retries += 1
+            logger.warning(f'{error}. Повтор {attempt}/{self.max_retries} через {delay:.1f} сек')
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """Состояние circuit breaker и счётчики повторов"""
+        return {
+            'state': self.breaker.state,
+            'trips': self.breaker.trips,
+            'retries': self.retries,
+            'failures': self.failures,
+        }
+
+
+async def iter_sse(response: aiohttp.ClientResponse):
+    """Чанки chat.completion.chunk из SSE ответа (stream: true)"""
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8').strip()
+        if not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            return
+        yield json.loads(payload)
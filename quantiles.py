@@ -0,0 +1,14 @@
+"""
+Перцентили по выборкам в памяти для stats() подсистем и бенчмарков.
+
+Одна формула на весь бот: p95 очереди к AI и p95 отправки в Telegram
+должны означать одно и то же.
+"""
+
+
+def percentile(values, fraction: float):
+    """Значение выборки на доле fraction (0.5 - медиана), 0 для пустой"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
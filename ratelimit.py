@@ -0,0 +1,158 @@
+"""
+Ограничители частоты с постоянной стоимостью на сообщение.
+
+RateLimiter - лимит "не больше limit событий за window секунд" на ключ
+(пользователя) по скользящему окну из двух счётчиков: текущее окно плюс
+взвешенный остаток предыдущего. На ключ - один маленький объект, проверка
+O(1). Ключи лежат в порядке последнего обращения, поэтому давно молчащие
+пользователи снимаются с головы без полного обхода.
+
+RateMeter - кольцевой буфер посекундных счётчиков для общей частоты событий
+(например, сообщений бота за последнюю минуту). Память фиксированная.
+
+TokenBucket - ведро токенов для равномерной отправки: reserve() сразу
+занимает токен (можно в долг) и говорит, сколько ждать своей очереди.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class SlidingWindow:
+    """Счётчики текущего и предыдущего окна одного ключа"""
+    __slots__ = ('window_start', 'current', 'previous', 'last_seen')
+
+    def __init__(self, window_start: float):
+        self.window_start = window_start
+        self.current = 0
+        self.previous = 0
+        self.last_seen = window_start
+
+
+class RateLimiter:
+    """Скользящее окно limit событий за window секунд на ключ"""
+
+    def __init__(self, limit: int, window: float, idle_timeout: float | None = None,
+                 sweep_batch: int = 8, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        # Ключ без событий дольше idle_timeout забывается (его окна уже пусты)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else window * 2
+        # Сколько молчащих ключей снимать за одну проверку: работа на сообщение ограничена
+        self.sweep_batch = sweep_batch
+        self.clock = clock
+        self._keys = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def hit(self, key) -> bool:
+        """Учёт события; False если лимит для ключа уже исчерпан (событие не засчитывается)"""
+        now = self.clock()
+        self._sweep(now)
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = SlidingWindow(now)
+        else:
+            self._keys.move_to_end(key)
+            self._roll(state, now)
+        state.last_seen = now
+
+        # Доля предыдущего окна, всё ещё попадающая в скользящее окно
+        overlap = 1.0 - (now - state.window_start) / self.window
+        if state.current + state.previous * overlap >= self.limit:
+            self.rejected += 1
+            return False
+        state.current += 1
+        self.allowed += 1
+        return True
+
+    def _roll(self, state: SlidingWindow, now: float):
+        elapsed = now - state.window_start
+        if elapsed < self.window:
+            return
+        if elapsed < self.window * 2:
+            state.previous = state.current
+            state.window_start += self.window
+        else:
+            state.previous = 0
+            state.window_start = now
+        state.current = 0
+
+    def _sweep(self, now: float):
+        """Снятие до sweep_batch самых давно молчащих ключей"""
+        keys = self._keys
+        for _ in range(self.sweep_batch):
+            if not keys:
+                return
+            key, state = next(iter(keys.items()))
+            if now - state.last_seen < self.idle_timeout:
+                return
+            del keys[key]
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        """Отслеживаемых ключей и счётчики решений"""
+        return {
+            'keys': len(self._keys),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'evicted': self.evicted,
+        }
+
+
+class RateMeter:
+    """Частота событий за последние window секунд в кольце посекундных счётчиков"""
+
+    def __init__(self, window: int = 60, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._counts = [0] * window
+        self._seconds = [-1] * window
+        self.total = 0
+
+    def record(self, count: int = 1):
+        second = int(self.clock())
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._counts[slot] = 0
+        self._counts[slot] += count
+        self.total += count
+
+    def count(self) -> int:
+        """Событий за последние window секунд (включая текущую)"""
+        oldest = int(self.clock()) - self.window
+        return sum(count for count, second in zip(self._counts, self._seconds) if second > oldest)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity в запасе"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Занять токен; сколько секунд ждать до отправки (0 - можно сразу)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, until: float):
+        """Никого не пропускать до until (флуд-контроль на стороне сервера)"""
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        """Ведро полное и не заблокировано - его можно забыть"""
+        full = self.tokens + (now - self.updated) * self.rate >= self.capacity
+        return full and now >= self.blocked_until
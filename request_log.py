@@ -0,0 +1,68 @@
+"""
+Отложенная (write-behind) запись логов запросов.
+
+Каждый ответ AI - строка в request_logs и +1 в request_hourly. Это самая
+частая запись в боте, и с коммитом на строку она занимала поток БД между
+всеми остальными запросами. Теперь строки копятся в WriteBehindBuffer и
+пишутся одной транзакцией через executemany.
+
+Пока строка не записана, она всё равно занимает слот дневного лимита:
+pending(user_id, day) прибавляется к счётчику из БД там, где лимит читается
+из базы (промах кэша прав). Счётчик снимается в момент отправки пачки на
+поток БД - чтения, поставленные после неё, уже видят строки в базе.
+"""
+
+from write_behind import WriteBehindBuffer
+
+
+class RequestLog(WriteBehindBuffer):
+    """Буфер строк request_logs (user_id, ts, day) с пакетной записью"""
+
+    label = 'логи запросов'
+
+    def __init__(self, storage, flush_rows: int = 100, flush_interval: float = 0.2):
+        super().__init__(storage.save_request_logs, flush_rows, flush_interval)
+        self.storage = storage
+        self._pending = {}
+        self.logged = 0
+        self.released = 0
+
+    def add(self, user_id: int, ts: int, day: str):
+        """Запрос пользователя в буфер; сразу учитывается в pending"""
+        key = (user_id, day)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self.logged += 1
+        self._append((user_id, ts, day))
+
+    def pending(self, user_id: int, day: str) -> int:
+        """Сколько запросов пользователя за день ещё не записано в БД"""
+        return self._pending.get((user_id, day), 0)
+
+    def _unpend(self, rows: list[tuple[int, int, str]], delta: int = -1):
+        for user_id, _, day in rows:
+            key = (user_id, day)
+            count = self._pending.get(key, 0) + delta
+            if count > 0:
+                self._pending[key] = count
+            else:
+                self._pending.pop(key, None)
+
+    def _detached(self, rows: list[tuple[int, int, str]]):
+        self._unpend(rows)
+
+    def _restored(self, rows: list[tuple[int, int, str]]):
+        self._unpend(rows, +1)
+
+    async def release(self, user_id: int, ts: int, day: str):
+        """Возврат слота: из буфера, если строка ещё не записана, иначе из БД"""
+        row = (user_id, ts, day)
+        if self._discard(row):
+            self._unpend([row])
+        else:
+            # Пачка со строкой уже ушла на поток БД: удаление встанет за ней
+            await self.storage.release_request(user_id, ts)
+        self.released += 1
+
+    def stats(self) -> dict:
+        """Размер буфера и счётчики записи"""
+        return {**super().stats(), 'logged': self.logged, 'released': self.released}
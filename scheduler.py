@@ -0,0 +1,122 @@
+"""
+Планировщик запросов к AI.
+
+Ограничивает число одновременных запросов к ProxyAPI. Когда все слоты
+заняты, запросы ждут в очереди с приоритетом: админ, затем премиум,
+затем бесплатные пользователи. Кто прождал дольше max_wait - получает
+SchedulerBusy и быстрый ответ "занято" вместо долгого ожидания. Служебные
+запросы идут с самым низким приоритетом и пропускают вперёд пользователей.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from quantiles import percentile
+
+# Приоритеты: меньше - раньше
+PRIORITY_ADMIN = 0
+PRIORITY_PREMIUM = 1
+PRIORITY_FREE = 2
+PRIORITY_BACKGROUND = 3  # Служебные запросы (сжатие истории)
+
+
+class SchedulerBusy(Exception):
+    """Слот к AI не освободился за отведённое время"""
+
+
+class LLMScheduler:
+    """Ограничение параллельных запросов к upstream с приоритетной очередью"""
+
+    def __init__(self, max_in_flight: int = 8, max_wait: float = 20.0):
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._waits = deque(maxlen=1000)
+        self.max_depth = 0
+        self.served = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        """Сколько запросов сейчас ждут слот"""
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_FREE):
+        """Занять слот на время запроса к AI"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int = PRIORITY_FREE):
+        """Ожидание слота; SchedulerBusy если не дождались за max_wait"""
+        started = time.monotonic()
+        if self.in_flight < self.max_in_flight and not self._waiting:
+            self.in_flight += 1
+            self._record(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._waiting += 1
+        self.max_depth = max(self.max_depth, self._waiting)
+
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+
+        if not future.done():
+            self._abandon(future)
+            self.rejected += 1
+            raise SchedulerBusy(f'Нет свободного слота за {self.max_wait:.0f} сек')
+        self._record(time.monotonic() - started)
+
+    def _abandon(self, future: asyncio.Future):
+        """Ожидающий ушёл: снять его с очереди или вернуть уже выданный слот"""
+        if future.done():
+            self.release()
+        else:
+            # Запись остаётся в куче и будет пропущена при выдаче слота
+            future.cancel()
+            self._waiting -= 1
+
+    def release(self):
+        """Освобождение слота: передаём его следующему по приоритету"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._waiting -= 1
+            future.set_result(None)
+            return
+        self.in_flight -= 1
+
+    def _record(self, wait: float):
+        self.served += 1
+        self._waits.append(wait)
+
+    def stats(self) -> dict:
+        """Загрузка, глубина очереди и время ожидания слота"""
+        waits = self._waits
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'depth': self._waiting,
+            'max_depth': self.max_depth,
+            'served': self.served,
+            'rejected': self.rejected,
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p95': percentile(waits, 0.95),
+            'wait_max': max(waits, default=0.0),
+        }
@@ -0,0 +1,246 @@
+"""
+Горизонтальное масштабирование: фронт-процесс и N процессов-воркеров.
+
+Фронт только принимает апдейты (long polling или webhook) и, не разбирая
+их в Update, раздаёт сырой JSON воркерам: владелец апдейта - воркер
+user_id % N. Каждый воркер - обычное Application со всеми хендлерами, но без
+Updater: апдейты приходят из его очереди multiprocessing. Поэтому всё
+состояние пользователя (история, антиспам, склейка, ведро отправки в его
+чат, кэш прав) живёт ровно в одном процессе, а лимиты, премиум и статистика
+остаются верными через общую SQLite (WAL, BEGIN IMMEDIATE между процессами).
+
+Воркеры игнорируют SIGINT/SIGTERM и останавливаются по сигналу фронта
+(None в очереди) - после того как фронт перестал принимать апдейты, поэтому
+уже принятое дорабатывается. Если фронт умер, воркер замечает это сам.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from collections import deque
+
+import aiohttp
+from telegram import Update
+
+from quantiles import percentile
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер проверяет, жив ли фронт, пока очередь пуста, сек
+PARENT_CHECK_INTERVAL = 1.0
+
+
+def owner_of(data: dict) -> int | None:
+    """Владелец сырого апдейта: отправитель, иначе чат (как update_user_id)"""
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user')
+        if sender:
+            return sender['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return None
+
+
+def shard_of(data: dict, workers: int) -> int:
+    """Номер воркера для апдейта; апдейты без владельца - нулевому"""
+    owner = owner_of(data)
+    # % в Python неотрицателен и для отрицательных id групп
+    return owner % workers if owner is not None else 0
+
+
+class ShardFront:
+    """Приём апдейтов и раздача их воркерам по user_id"""
+
+    def __init__(self, token: str, workers: int, target, base_url: str = 'https://api.telegram.org/bot',
+                 poll_timeout: int = 30):
+        if workers < 2:
+            raise ValueError('Шардирование имеет смысл от двух воркеров')
+        self.api_url = f'{base_url}{token}'
+        self.workers = workers
+        # target(index, inbox) - функция процесса-воркера (должна импортироваться по имени)
+        self.target = target
+        self.poll_timeout = poll_timeout
+        self._inboxes = []
+        self._processes = []
+        self._session = None
+        self._stopping = False
+        self._batches = deque(maxlen=1000)
+        self.routed = [0] * workers
+
+    def start(self):
+        """Запуск процессов-воркеров"""
+        # spawn: воркер импортирует модуль заново, без унаследованных потоков и цикла событий
+        ctx = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            inbox = ctx.Queue()
+            process = ctx.Process(target=self.target, args=(index, inbox), name=f'worker-{index}')
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        logger.info(f'Запущено воркеров: {self.workers}')
+
+    async def stop(self, timeout: float = 60):
+        """Сигнал воркерам доработать очередь и дождаться их завершения"""
+        self._stopping = True
+        for inbox in self._inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.error(f'{process.name} не завершился за {timeout} сек, останавливаем принудительно')
+                process.terminate()
+        for inbox in self._inboxes:
+            inbox.close()
+        if self._session is not None:
+            await self._session.close()
+        logger.info(f'Воркеры остановлены, разослано апдейтов: {sum(self.routed)}')
+
+    def route(self, batch: list[dict]):
+        """Раздача пачки сырых апдейтов воркерам-владельцам (порядок внутри воркера сохраняется)"""
+        shards = [[] for _ in range(self.workers)]
+        for data in batch:
+            shards[shard_of(data, self.workers)].append(data)
+        for index, updates in enumerate(shards):
+            if not updates:
+                continue
+            if not self._processes[index].is_alive():
+                logger.error(f'{self._processes[index].name} не работает, апдейтов потеряно: {len(updates)}')
+                continue
+            # Queue.put не блокирует: пишет фоновый поток очереди
+            self._inboxes[index].put(updates)
+            self.routed[index] += len(updates)
+        self._batches.append(len(batch))
+
+    async def call(self, method: str, **params):
+        """Вызов Bot API с сырым JSON (фронту не нужны объекты PTB)"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        timeout = aiohttp.ClientTimeout(total=self.poll_timeout + 10)
+        async with self._session.post(f'{self.api_url}/{method}', json=params, timeout=timeout) as response:
+            payload = await response.json()
+        if not payload.get('ok'):
+            raise RuntimeError(f'{method}: {payload.get("description")}')
+        return payload['result']
+
+    async def poll(self, stop: asyncio.Event):
+        """Long polling до stop; подтверждает offset последней пачки перед выходом"""
+        await self.call('deleteWebhook')
+        offset = 0
+        delay = 1.0
+        poll = asyncio.ensure_future(stop.wait())
+        try:
+            while not stop.is_set():
+                request = asyncio.ensure_future(self.call(
+                    'getUpdates', offset=offset, timeout=self.poll_timeout, allowed_updates=Update.ALL_TYPES
+                ))
+                await asyncio.wait({request, poll}, return_when=asyncio.FIRST_COMPLETED)
+                if not request.done():
+                    # Остановка во время long polling: апдейты этого запроса ещё не подтверждены
+                    request.cancel()
+                    break
+                try:
+                    updates = request.result()
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    logger.warning(f'getUpdates не удался: {e}, повтор через {delay:.0f} сек')
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30)
+                    continue
+                delay = 1.0
+                if updates:
+                    offset = updates[-1]['update_id'] + 1
+                    self.route(updates)
+        finally:
+            poll.cancel()
+        if offset:
+            # Иначе Telegram пришлёт последнюю пачку ещё раз после перезапуска
+            await self.call('getUpdates', offset=offset, timeout=0)
+
+    def stats(self) -> dict:
+        """Сколько апдейтов досталось каждому воркеру"""
+        return {
+            'workers': self.workers,
+            'alive': sum(process.is_alive() for process in self._processes),
+            'routed': list(self.routed),
+            'batch_p50': percentile(self._batches, 0.5),
+        }
+
+
+async def serve_front(front: ShardFront, server=None, url: str = '', max_connections: int = 40):
+    """
+    Жизненный цикл фронта (аналог run_polling): воркеры, приём апдейтов
+    polling'ом или webhook'ом (server с router=front.route) до SIGINT/SIGTERM,
+    затем остановка приёма и воркеров.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    front.start()
+    try:
+        if server is None:
+            await front.poll(stop)
+        else:
+            await server.start()
+            await front.call(
+                'setWebhook',
+                url=url,
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=max_connections,
+            )
+            logger.info(f'Webhook зарегистрирован: {url}')
+            await stop.wait()
+    finally:
+        logger.info('Остановка: воркеры дорабатывают принятые апдейты')
+        if server is not None:
+            await server.stop()
+        await front.stop()
+
+
+async def serve_worker(application, inbox):
+    """Жизненный цикл воркера: Application без Updater, апдейты из inbox"""
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    bot = application.bot
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        while True:
+            try:
+                batch = await loop.run_in_executor(None, inbox.get, True, PARENT_CHECK_INTERVAL)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.error('Фронт-процесс завершился, воркер останавливается')
+                    break
+                continue
+            if batch is None:
+                break
+            for data in batch:
+                try:
+                    application.update_queue.put_nowait(Update.de_json(data, bot))
+                except Exception as e:
+                    logger.error(f'Не удалось разобрать апдейт от фронта: {e}')
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_worker(application, inbox):
+    """Точка входа процесса-воркера: остановкой управляет фронт"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(serve_worker(application, inbox))
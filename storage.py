@@ -0,0 +1,586 @@
+"""
+Хранилище SQLite для Tyler Bot.
+
+Одно долгоживущее соединение в режиме WAL живёт на отдельном потоке.
+Хендлеры вызывают асинхронные методы и не блокируют event loop на диске.
+"""
+
+import asyncio
+import logging
+import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class GateResult(NamedTuple):
+    """Результат проверки лимита в request gate"""
+    allowed: bool
+    premium_until: datetime | None
+    used_today: int
+
+
+def _migrate_initial(conn: sqlite3.Connection):
+    """исходная схема users и request_logs"""
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            premium_until TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица логов запросов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS request_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+def _migrate_request_logs_day(conn: sqlite3.Connection):
+    """epoch-время и день МСК в request_logs с индексами"""
+    conn.execute('ALTER TABLE request_logs ADD COLUMN ts INTEGER')
+    conn.execute('ALTER TABLE request_logs ADD COLUMN day TEXT')
+    # timestamp в старых строках - UTC из CURRENT_TIMESTAMP, МСК = UTC+3 (без перехода на летнее время)
+    conn.execute('''
+        UPDATE request_logs
+        SET ts = CAST(strftime('%s', timestamp) AS INTEGER),
+            day = date(timestamp, '+3 hours')
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_request_logs_user_day ON request_logs (user_id, day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_request_logs_ts ON request_logs (ts)')
+
+
+def _migrate_request_hourly(conn: sqlite3.Connection):
+    """почасовой rollup запросов по пользователям для /stats"""
+    # Строка = (час, пользователь): сумма по строкам даёт запросы,
+    # количество строк - уникальных пользователей за час
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS request_hourly (
+            hour INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            PRIMARY KEY (hour, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO request_hourly (hour, user_id, requests)
+        SELECT ts / 3600, user_id, COUNT(*) FROM request_logs
+        WHERE ts IS NOT NULL
+        GROUP BY ts / 3600, user_id
+    ''')
+
+
+def _migrate_conversations(conn: sqlite3.Connection):
+    """таблица историй диалогов"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id INTEGER PRIMARY KEY,
+            messages TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+
+
+def _migrate_usage_ledger(conn: sqlite3.Connection):
+    """журнал токенов и стоимости запросов к AI"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            user_id INTEGER,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            reasoning_tokens INTEGER NOT NULL,
+            cost_usd REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_ledger_ts ON usage_ledger (ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_ledger_day ON usage_ledger (day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_ledger_user_day ON usage_ledger (user_id, day)')
+
+
+def _migrate_request_daily(conn: sqlite3.Connection):
+    """дневной rollup запросов по пользователям для окон 7 и 30 дней"""
+    # Как request_hourly, но по дням МСК: за 30 дней у пользователя не больше 30 строк
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS request_daily (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO request_daily (day, user_id, requests)
+        SELECT day, user_id, COUNT(*) FROM request_logs
+        WHERE day IS NOT NULL
+        GROUP BY day, user_id
+    ''')
+
+
+def _migrate_usage_hourly(conn: sqlite3.Connection):
+    """почасовой rollup журнала токенов по моделям для /stats"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_hourly (
+            hour INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            reasoning_tokens INTEGER NOT NULL,
+            cost_usd REAL NOT NULL,
+            PRIMARY KEY (hour, model)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO usage_hourly (hour, model, requests, prompt_tokens, cached_tokens,
+                                  completion_tokens, reasoning_tokens, cost_usd)
+        SELECT ts / 3600, model, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens),
+               SUM(completion_tokens), SUM(reasoning_tokens), SUM(cost_usd)
+        FROM usage_ledger
+        GROUP BY ts / 3600, model
+    ''')
+
+
+def _migrate_drop_usage_day_indexes(conn: sqlite3.Connection):
+    """удаление индексов журнала по дням: дневные суммы читаются из usage_hourly"""
+    conn.execute('DROP INDEX IF EXISTS idx_usage_ledger_day')
+    conn.execute('DROP INDEX IF EXISTS idx_usage_ledger_user_day')
+
+
+# Миграции схемы: номер версии = позиция в списке + 1. Только дописывать в конец.
+MIGRATIONS = [
+    _migrate_initial,
+    _migrate_request_logs_day,
+    _migrate_request_hourly,
+    _migrate_conversations,
+    _migrate_usage_ledger,
+    _migrate_request_daily,
+    _migrate_usage_hourly,
+    _migrate_drop_usage_day_indexes,
+]
+
+
+class Storage:
+    """Асинхронная обёртка над одним соединением SQLite на выделенном потоке"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._conn = None
+        self._executor = None
+        # Всего пользователей: считается один раз при старте и растёт
+        # только при реальной вставке, чтобы не делать COUNT(*) на горячем пути
+        self.user_count = 0
+        # Обращений к потоку БД - для бенчмарков "операций на сообщение"
+        self.operations = 0
+
+    async def start(self):
+        """Запуск потока БД, открытие соединения и создание схемы"""
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        await self._run(self._open)
+        logger.info(f'SQLite открыт: {self.db_file} (WAL)')
+
+    async def close(self):
+        """Закрытие соединения и остановка потока БД"""
+        if self._executor is None:
+            return
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _run(self, func, *args):
+        """Выполнение функции на потоке БД"""
+        if self._executor is None:
+            raise RuntimeError('Storage не запущен')
+        self.operations += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # В WAL режиме NORMAL безопасен и не делает fsync на каждый коммит
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        self._conn = conn
+        self._init_schema()
+        self.user_count = self._count_users()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _init_schema(self):
+        """Применение недостающих миграций по PRAGMA user_version"""
+        conn = self._conn
+        while True:
+            try:
+                # Версия читается под блокировкой записи: воркеры стартуют одновременно
+                # и не должны применить одну миграцию дважды
+                conn.execute('BEGIN IMMEDIATE')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    conn.commit()
+                    return
+                migration = MIGRATIONS[version]
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f'Миграция БД до версии {version + 1}: {migration.__doc__}')
+
+    # --- Пользователи ---
+
+    def _insert_user(self, user_id: int) -> bool:
+        cursor = self._conn.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+        if cursor.rowcount == 1:
+            self.user_count += 1
+            return True
+        return False
+
+    def _ensure_user(self, user_id: int):
+        inserted = False
+        try:
+            inserted = self._insert_user(user_id)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            if inserted:
+                self.user_count -= 1
+            raise
+
+    async def ensure_user(self, user_id: int):
+        """Убедиться что пользователь существует в БД"""
+        await self._run(self._ensure_user, user_id)
+
+    def _count_users(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    async def count_users(self) -> int:
+        """Количество уникальных пользователей"""
+        return await self._run(self._count_users)
+
+    def _get_premium_until(self, user_id: int):
+        row = self._conn.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row and row[0]:
+            return datetime.fromisoformat(row[0])
+        return None
+
+    async def get_premium_until(self, user_id: int):
+        """Дата окончания премиума или None"""
+        return await self._run(self._get_premium_until, user_id)
+
+    def _add_premium(self, user_id: int, now: datetime, days: int) -> datetime:
+        inserted = False
+        try:
+            inserted = self._insert_user(user_id)
+            current_expiry = self._get_premium_until(user_id)
+
+            if current_expiry and current_expiry > now:
+                new_expiry = current_expiry + timedelta(days=days)
+            else:
+                new_expiry = now + timedelta(days=days)
+
+            self._conn.execute('UPDATE users SET premium_until = ? WHERE user_id = ?',
+                               (new_expiry.isoformat(), user_id))
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            if inserted:
+                self.user_count -= 1
+            raise
+        return new_expiry
+
+    async def add_premium(self, user_id: int, now: datetime, days: int) -> datetime:
+        """Продление премиума на days дней от now или от текущей даты окончания"""
+        return await self._run(self._add_premium, user_id, now, days)
+
+    # --- Логи запросов ---
+
+    def _insert_request_logs(self, rows: list[tuple[int, int, str]]):
+        conn = self._conn
+        conn.executemany('INSERT INTO request_logs (user_id, ts, day) VALUES (?, ?, ?)', rows)
+        hourly = Counter((ts // 3600, user_id) for user_id, ts, _ in rows)
+        conn.executemany('''
+            INSERT INTO request_hourly (hour, user_id, requests) VALUES (?, ?, ?)
+            ON CONFLICT (hour, user_id) DO UPDATE SET requests = requests + excluded.requests
+        ''', [(hour, user_id, count) for (hour, user_id), count in hourly.items()])
+        daily = Counter((day, user_id) for user_id, _, day in rows)
+        conn.executemany('''
+            INSERT INTO request_daily (day, user_id, requests) VALUES (?, ?, ?)
+            ON CONFLICT (day, user_id) DO UPDATE SET requests = requests + excluded.requests
+        ''', [(day, user_id, count) for (day, user_id), count in daily.items()])
+
+    def _save_request_logs(self, rows: list[tuple[int, int, str]]):
+        conn = self._conn
+        try:
+            self._insert_request_logs(rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def save_request_logs(self, rows: list[tuple[int, int, str]]):
+        """Пакетная запись запросов (user_id, unix-время, день) и rollup одной транзакцией"""
+        await self._run(self._save_request_logs, rows)
+
+    def _count_user_requests_on(self, user_id: int, day: str) -> int:
+        return self._conn.execute('''
+            SELECT COUNT(*) FROM request_logs
+            WHERE user_id = ?
+            AND day = ?
+        ''', (user_id, day)).fetchone()[0]
+
+    def _load_entitlement(self, user_id: int, day: str) -> tuple[datetime | None, int]:
+        return self._get_premium_until(user_id), self._count_user_requests_on(user_id, day)
+
+    async def load_entitlement(self, user_id: int, day: str) -> tuple[datetime | None, int]:
+        """Премиум и количество запросов за день одним заходом на поток БД"""
+        return await self._run(self._load_entitlement, user_id, day)
+
+    def _reserve_request(self, user_id: int, now: datetime, day: str, daily_limit: int | None,
+                         pending: int) -> GateResult:
+        conn = self._conn
+        inserted = False
+        try:
+            # IMMEDIATE сразу берёт блокировку на запись: два одновременных
+            # сообщения не смогут оба пройти проверку лимита
+            conn.execute('BEGIN IMMEDIATE')
+            inserted = self._insert_user(user_id)
+            premium_until = self._get_premium_until(user_id)
+            used_today = self._count_user_requests_on(user_id, day) + pending
+
+            unlimited = daily_limit is None or (premium_until is not None and now < premium_until)
+            allowed = unlimited or used_today < daily_limit
+
+            if allowed:
+                self._insert_request_logs([(user_id, int(now.timestamp()), day)])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if inserted:
+                self.user_count -= 1
+            raise
+        return GateResult(allowed, premium_until, used_today)
+
+    async def reserve_request(self, user_id: int, now: datetime, day: str, daily_limit: int | None,
+                              pending: int = 0) -> GateResult:
+        """
+        Request gate: в одной транзакции создаёт пользователя, читает премиум,
+        проверяет дневной лимит и резервирует слот записью в request_logs.
+        daily_limit=None - безлимит (админ), pending - ещё не записанные запросы за день.
+        """
+        return await self._run(self._reserve_request, user_id, now, day, daily_limit, pending)
+
+    def _release_request(self, user_id: int, ts: int):
+        conn = self._conn
+        try:
+            # Строки одного пользователя с одним ts неразличимы - удаляем любую
+            row = conn.execute('SELECT id, day FROM request_logs WHERE user_id = ? AND ts = ? LIMIT 1',
+                               (user_id, ts)).fetchone()
+            if row is None:
+                return
+            row_id, day = row
+            conn.execute('DELETE FROM request_logs WHERE id = ?', (row_id,))
+            conn.execute('UPDATE request_hourly SET requests = requests - 1 WHERE hour = ? AND user_id = ?',
+                         (ts // 3600, user_id))
+            conn.execute('DELETE FROM request_hourly WHERE hour = ? AND user_id = ? AND requests <= 0',
+                         (ts // 3600, user_id))
+            conn.execute('UPDATE request_daily SET requests = requests - 1 WHERE day = ? AND user_id = ?',
+                         (day, user_id))
+            conn.execute('DELETE FROM request_daily WHERE day = ? AND user_id = ? AND requests <= 0',
+                         (day, user_id))
+            conn.commit()
+        except Exception:
+            # Половина возврата не должна уехать с коммитом следующего писателя
+            conn.rollback()
+            raise
+
+    async def release_request(self, user_id: int, ts: int):
+        """Возврат зарезервированного слота (запрос к AI не удался)"""
+        await self._run(self._release_request, user_id, ts)
+
+    async def count_user_requests_on(self, user_id: int, day: str) -> int:
+        """Количество запросов пользователя за день YYYY-MM-DD"""
+        return await self._run(self._count_user_requests_on, user_id, day)
+
+    # --- Статистика по почасовому rollup ---
+    # Окна выравниваются по началу часа: since попадает в свой часовой bucket
+
+    def _count_requests_since(self, since: int) -> int:
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(requests), 0) FROM request_hourly WHERE hour >= ?', (since // 3600,)
+        ).fetchone()[0]
+
+    async def count_requests_since(self, since: int) -> int:
+        """Количество запросов начиная с часа, в который попадает unix-время since"""
+        return await self._run(self._count_requests_since, since)
+
+    def _count_active_users_since(self, since: int) -> int:
+        return self._conn.execute(
+            'SELECT COUNT(DISTINCT user_id) FROM request_hourly WHERE hour >= ?', (since // 3600,)
+        ).fetchone()[0]
+
+    async def count_active_users_since(self, since: int) -> int:
+        """Количество уникальных пользователей с запросами начиная с часа unix-времени since"""
+        return await self._run(self._count_active_users_since, since)
+
+    def _hourly_histogram(self, since: int) -> list[tuple[int, int, int]]:
+        return self._conn.execute('''
+            SELECT hour * 3600, SUM(requests), COUNT(*) FROM request_hourly
+            WHERE hour >= ?
+            GROUP BY hour
+            ORDER BY hour
+        ''', (since // 3600,)).fetchall()
+
+    async def hourly_histogram(self, since: int) -> list[tuple[int, int, int]]:
+        """Список (начало часа unix, запросов, уникальных пользователей) начиная с часа since"""
+        return await self._run(self._hourly_histogram, since)
+
+    # --- Статистика по дневному rollup ---
+
+    def _daily_totals(self, since_day: str) -> tuple[int, int]:
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(requests), 0), COUNT(DISTINCT user_id) FROM request_daily WHERE day >= ?',
+            (since_day,)
+        ).fetchone()
+
+    async def daily_totals(self, since_day: str) -> tuple[int, int]:
+        """Запросов и уникальных пользователей начиная с дня YYYY-MM-DD (МСК)"""
+        return await self._run(self._daily_totals, since_day)
+
+    # --- Истории диалогов ---
+
+    def _load_conversation(self, user_id: int) -> str | None:
+        row = self._conn.execute('SELECT messages FROM conversations WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    async def load_conversation(self, user_id: int) -> str | None:
+        """JSON истории пользователя или None"""
+        return await self._run(self._load_conversation, user_id)
+
+    def _save_conversations(self, rows: list[tuple[int, str, int]]):
+        conn = self._conn
+        try:
+            conn.executemany('''
+                INSERT INTO conversations (user_id, messages, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET messages = excluded.messages, updated_at = excluded.updated_at
+            ''', rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def save_conversations(self, rows: list[tuple[int, str, int]]):
+        """Пакетная запись историй (user_id, JSON, unix-время) одной транзакцией"""
+        await self._run(self._save_conversations, rows)
+
+    # --- Журнал токенов и стоимости ---
+
+    def _save_usage(self, rows: list[tuple]):
+        conn = self._conn
+        try:
+            conn.executemany('''
+                INSERT INTO usage_ledger (ts, day, user_id, model, prompt_tokens, cached_tokens,
+                                          completion_tokens, reasoning_tokens, cost_usd)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # Rollup по (час, модель) агрегируется до записи: одна строка на пару в пачке
+            hourly = {}
+            for ts, _, _, model, prompt, cached, completion, reasoning, cost in rows:
+                sums = hourly.setdefault((ts // 3600, model), [0, 0, 0, 0, 0, 0.0])
+                for i, value in enumerate((1, prompt, cached, completion, reasoning, cost)):
+                    sums[i] += value
+            conn.executemany('''
+                INSERT INTO usage_hourly (hour, model, requests, prompt_tokens, cached_tokens,
+                                          completion_tokens, reasoning_tokens, cost_usd)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (hour, model) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    cached_tokens = cached_tokens + excluded.cached_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    reasoning_tokens = reasoning_tokens + excluded.reasoning_tokens,
+                    cost_usd = cost_usd + excluded.cost_usd
+            ''', [(hour, model, *sums) for (hour, model), sums in hourly.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def save_usage(self, rows: list[tuple]):
+        """Пакетная запись строк журнала (ts, day, user_id, model, prompt, cached, completion, reasoning, cost_usd)"""
+        await self._run(self._save_usage, rows)
+
+    # Агрегаты: (запросов, prompt, cached, completion, reasoning, стоимость USD)
+    _USAGE_SUMS = '''COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(cached_tokens), 0),
+        COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(reasoning_tokens), 0), COALESCE(SUM(cost_usd), 0)'''
+    _USAGE_HOURLY_SUMS = '''COALESCE(SUM(requests), 0), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(cached_tokens), 0),
+        COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(reasoning_tokens), 0), COALESCE(SUM(cost_usd), 0)'''
+
+    # Итоги и разбивка по моделям - из почасового rollup: не больше строк, чем часов x моделей
+
+    def _usage_totals(self, since: int) -> tuple:
+        return self._conn.execute(
+            f'SELECT {self._USAGE_HOURLY_SUMS} FROM usage_hourly WHERE hour >= ?', (since // 3600,)
+        ).fetchone()
+
+    async def usage_totals(self, since: int) -> tuple:
+        """Сумма токенов и стоимости начиная с часа, в который попадает unix-время since"""
+        return await self._run(self._usage_totals, since)
+
+    def _usage_by_model(self, since: int) -> list[tuple]:
+        return self._conn.execute(f'''
+            SELECT model, {self._USAGE_HOURLY_SUMS} FROM usage_hourly
+            WHERE hour >= ?
+            GROUP BY model
+            ORDER BY SUM(cost_usd) DESC
+        ''', (since // 3600,)).fetchall()
+
+    async def usage_by_model(self, since: int) -> list[tuple]:
+        """Суммы по моделям начиная с часа since, дорогие первыми"""
+        return await self._run(self._usage_by_model, since)
+
+    def _usage_by_day(self, since: int) -> list[tuple]:
+        # День МСК = час UTC + 3 (без перехода на летнее время), границы дней совпадают с часами
+        return self._conn.execute(f'''
+            SELECT date(hour * 3600, 'unixepoch', '+3 hours') AS day, {self._USAGE_HOURLY_SUMS} FROM usage_hourly
+            WHERE hour >= ?
+            GROUP BY day
+            ORDER BY day
+        ''', (since // 3600,)).fetchall()
+
+    async def usage_by_day(self, since: int) -> list[tuple]:
+        """Суммы по дням МСК (YYYY-MM-DD) начиная с часа since, по порядку дней"""
+        return await self._run(self._usage_by_day, since)
+
+    def _usage_by_user(self, since: int, limit: int) -> list[tuple]:
+        return self._conn.execute(f'''
+            SELECT user_id, {self._USAGE_SUMS} FROM usage_ledger
+            WHERE ts >= ?
+            GROUP BY user_id
+            ORDER BY SUM(cost_usd) DESC
+            LIMIT ?
+        ''', (since, limit)).fetchall()
+
+    async def usage_by_user(self, since: int, limit: int = 10) -> list[tuple]:
+        """limit самых дорогих пользователей начиная с since (по журналу - окно держать коротким)"""
+        return await self._run(self._usage_by_user, since, limit)
@@ -0,0 +1,120 @@
+"""
+Прогрессивная отправка ответа в Telegram по мере генерации.
+
+Первый кусок текста отправляется отдельным сообщением сразу, как только
+пришёл первый токен. Дальше сообщение редактируется не чаще раза в
+min_interval секунд (лимиты Telegram на edit), в конце - финальная правка.
+"""
+
+import asyncio
+import logging
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Разбивка длинного текста на части не длиннее limit, по возможности по переносам строк"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+
+class ProgressiveReply:
+    """Ответ на сообщение пользователя, который дописывается по ходу стрима"""
+
+    def __init__(self, reply_to: Message, min_interval: float = 1.0):
+        self.reply_to = reply_to
+        self.min_interval = min_interval
+        self.message = None
+        self._shown = ''
+        # Куски стрима склеиваются только перед отправкой или правкой
+        self._parts = []
+        self._next_edit_at = 0.0
+        self._edit_task = None
+
+    @property
+    def started(self) -> bool:
+        """Было ли уже отправлено сообщение пользователю"""
+        return self.message is not None
+
+    async def update(self, delta: str):
+        """Новый кусок ответа; отправка/правка с троттлингом"""
+        self._parts.append(delta)
+        if self.message is not None:
+            # Правка идёт в фоне, чтобы не тормозить чтение стрима
+            if self._edit_task is not None and not self._edit_task.done():
+                return
+            if time.monotonic() < self._next_edit_at:
+                return
+
+        text = self._text()
+        if not text.strip():
+            return
+
+        if self.message is None:
+            self.message = await self.reply_to.reply_text(text)
+            self._shown = text
+            self._next_edit_at = time.monotonic() + self.min_interval
+            return
+        self._edit_task = asyncio.create_task(self._edit(text))
+
+    def _text(self) -> str:
+        """Накопленный текст, обрезанный до лимита сообщения"""
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0][:TELEGRAM_MESSAGE_LIMIT] if self._parts else ''
+
+    async def _edit(self, text: str):
+        if text == self._shown:
+            return
+        try:
+            await self.message.edit_text(text)
+            self._shown = text
+            self._next_edit_at = time.monotonic() + self.min_interval
+        except RetryAfter as e:
+            # Флуд-контроль: промежуточные правки можно пропустить
+            self._next_edit_at = time.monotonic() + e.retry_after
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f'Не удалось обновить сообщение: {e}')
+
+    async def finish(self, text: str) -> bool:
+        """
+        Финальная правка полным текстом (длинный хвост уходит доп. сообщениями).
+        Возвращает False, если сообщение ещё не отправлялось.
+        """
+        if self._edit_task is not None:
+            await self._edit_task
+            self._edit_task = None
+        if self.message is None:
+            return False
+
+        parts = split_message(text)
+        first = parts[0] if parts else text
+        while first != self._shown:
+            try:
+                await self.message.edit_text(first)
+                self._shown = first
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+                self._shown = first
+        for part in parts[1:]:
+            await self.reply_to.reply_text(part)
+        return True
@@ -0,0 +1,88 @@
+"""Склейка пачки сообщений: одна реплика на пачку, ожидание не держит слот обработчика"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import filters
+
+from coalescing import MessageCoalescer
+from updates import PerUserUpdateProcessor
+
+TEXT_MESSAGES = filters.TEXT & ~filters.COMMAND
+
+
+def make_update(user_id: int, message_id: int, text: str) -> Update:
+    message = Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, first_name='test', is_bot=False),
+        text=text,
+        # Команду фильтры узнают по entity, а не по слэшу
+        entities=[MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))] if text.startswith('/') else None,
+    )
+    return Update(update_id=message_id, message=message)
+
+
+def make_pipeline(window: float, max_concurrent: int = 1):
+    coalescer = MessageCoalescer(TEXT_MESSAGES, window)
+    processor = PerUserUpdateProcessor(max_concurrent, on_queued=coalescer.note, before_run=coalescer.settle)
+    handled = []
+    started = time.monotonic()
+
+    async def handle(update: Update):
+        if coalescer.absorbed(update.message):
+            return
+        if update.message.text.startswith('/'):
+            handled.append((update.effective_user.id, update.message.text, time.monotonic() - started))
+            return
+        text = coalescer.collect(update.effective_user.id, update.message)
+        handled.append((update.effective_user.id, text, time.monotonic() - started))
+
+    def send(update: Update):
+        return asyncio.create_task(processor.process_update(update, handle(update)))
+
+    return coalescer, send, handled
+
+
+def test_burst_is_one_turn():
+    async def scenario():
+        coalescer, send, handled = make_pipeline(window=0.2)
+        tasks = []
+        for message_id, text in enumerate(['раз', 'два', 'три'], start=1):
+            tasks.append(send(make_update(1, message_id, text)))
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*tasks)
+        return coalescer, handled
+
+    coalescer, handled = asyncio.run(scenario())
+    assert [(user_id, text) for user_id, text, _ in handled] == [(1, 'раз\nдва\nтри')]
+    assert coalescer.stats() == {'turns': 1, 'merged': 2, 'waiting': 0}
+
+
+def test_lone_message_waits_for_window():
+    async def scenario():
+        _, send, handled = make_pipeline(window=0.2)
+        await send(make_update(1, 1, 'одно'))
+        return handled
+
+    [(_, text, at)] = asyncio.run(scenario())
+    assert text == 'одно'
+    assert at >= 0.2
+
+
+def test_window_does_not_hold_handler_slot():
+    async def scenario():
+        # Один слот на всех: пока первый ждёт конец пачки, команда второго проходит сразу
+        _, send, handled = make_pipeline(window=0.3, max_concurrent=1)
+        first = send(make_update(1, 1, 'думаю...'))
+        await asyncio.sleep(0.05)
+        second = send(make_update(2, 2, '/start'))
+        await asyncio.gather(first, second)
+        return handled
+
+    handled = asyncio.run(scenario())
+    assert [(user_id, text) for user_id, text, _ in handled] == [(2, '/start'), (1, 'думаю...')]
+    assert handled[0][2] < 0.2
@@ -0,0 +1,119 @@
+"""Гонки истории диалогов: правки во время записи в БД и сжатие после вытеснения"""
+
+import asyncio
+import json
+
+from conversations import ChatHistory, ConversationStore
+
+
+class FakeStorage:
+    """conversations в словаре; save_conversations можно придержать событием"""
+
+    def __init__(self):
+        self.rows = {}
+        self.saving = asyncio.Event()
+        self.release = None
+
+    async def load_conversation(self, user_id: int) -> str | None:
+        return self.rows.get(user_id)
+
+    async def save_conversations(self, rows: list[tuple[int, str, int]]):
+        self.saving.set()
+        if self.release is not None:
+            await self.release.wait()
+        for user_id, messages, _ in rows:
+            self.rows[user_id] = messages
+
+
+def make_store(storage: FakeStorage, max_resident: int = 1) -> ConversationStore:
+    return ConversationStore(storage, lambda: ChatHistory(10), max_resident=max_resident)
+
+
+async def append(store: ConversationStore, user_id: int, role: str, content: str):
+    history = await store.get(user_id)
+    history.append(role, content)
+    store.mark_dirty(user_id)
+
+
+async def flush_while(store: ConversationStore, storage: FakeStorage, during):
+    """flush(), пока запись придержана, выполняется during()"""
+    storage.release = asyncio.Event()
+    storage.saving.clear()
+    flush = asyncio.create_task(store.flush())
+    await asyncio.wait_for(storage.saving.wait(), timeout=1)
+    await during()
+    storage.release.set()
+    await flush
+    storage.release = None
+
+
+def test_change_during_save_then_evicted_is_not_lost():
+    async def scenario():
+        storage = FakeStorage()
+        store = make_store(storage)
+        await append(store, 1, 'user', 'first')
+
+        async def change_and_evict():
+            await append(store, 1, 'user', 'second')
+            # max_resident=1: загрузка другого пользователя вытесняет первого в _pending
+            await store.get(2)
+
+        await flush_while(store, storage, change_and_evict)
+        await store.flush()
+        return storage, store
+
+    storage, store = asyncio.run(scenario())
+    assert json.loads(storage.rows[1]) == [
+        {'role': 'user', 'content': 'first'},
+        {'role': 'user', 'content': 'second'},
+    ]
+    assert store.stats()['pending'] == 0
+    assert store.stats()['dirty'] == 0
+
+
+def test_change_during_save_of_resident_history_is_saved_next_time():
+    async def scenario():
+        storage = FakeStorage()
+        store = make_store(storage, max_resident=10)
+        await append(store, 1, 'user', 'first')
+        await flush_while(store, storage, lambda: append(store, 1, 'assistant', 'second'))
+        await store.flush()
+        return storage
+
+    storage = asyncio.run(scenario())
+    assert [message['content'] for message in json.loads(storage.rows[1])] == ['first', 'second']
+
+
+def test_compact_after_evict_and_reload_does_not_duplicate():
+    async def scenario():
+        storage = FakeStorage()
+        store = make_store(storage)
+        for i in range(4):
+            await append(store, 1, 'user' if i % 2 == 0 else 'assistant', f'msg {i}')
+        await store.flush()
+
+        # Как summarize_history: берём старые сообщения, пока идёт запрос к AI,
+        # история вытесняется и загружается из БД заново - объекты Turn уже другие
+        turns = (await store.get(1)).oldest(2)
+        await store.get(2)
+        reloaded = await store.get(1)
+        assert reloaded.oldest(1)[0] is not turns[0]
+
+        reloaded.compact(turns, 'выжимка')
+        return reloaded
+
+    history = asyncio.run(scenario())
+    assert history.summary == 'выжимка'
+    assert [turn.content for turn in history] == ['msg 2', 'msg 3']
+
+
+def test_compact_keeps_turns_added_while_summarizing():
+    history = ChatHistory(4)
+    for i in range(4):
+        history.append('user', f'msg {i}')
+    turns = history.oldest(2)
+    # Буфер полон: новое сообщение вытесняет msg 0 ещё до конца сжатия
+    history.append('user', 'msg 4')
+
+    history.compact(turns, 'выжимка')
+    assert [turn.content for turn in history] == ['msg 2', 'msg 3', 'msg 4']
@@ -2,23 +2,40 @@
 Tyler Durden Telegram Bot
 
 Стоимость запросов:
-Цены в коде (строки ~42-44) для gpt-4o-mini примерные.
+Цены моделей (USD за 1M токенов) - MODEL_PRICES в usage.py, примерные.
 Актуальные цены проверяй на: https://proxyapi.ru/pricing
-Текущий курс доллара обнови в переменной usd_to_rub (строка ~45)
+Текущий курс доллара задаётся переменной окружения USD_TO_RUB
 """
 
+import asyncio
 import os
-import sqlite3
 import time
 import logging
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, PreCheckoutQueryHandler, filters, ContextTypes
-import aiohttp
-from collections import defaultdict
 import pytz
 
+from answer_cache import AnswerCache
+from coalescing import MessageCoalescer
+from context import ContextWindow, estimate_message_tokens, prompt_cache_key
+from conversations import ChatHistory, ConversationStore
+from delivery import FloodLimiter
+from entitlements import EntitlementCache, Reservation
+from metrics import Metrics, MetricsServer
+from proxyapi import CircuitBreaker, CircuitOpenError, ProxyAPIClient, ProxyAPIError, classify_response, iter_sse
+from ratelimit import RateLimiter, RateMeter
+from request_log import RequestLog
+from scheduler import LLMScheduler, SchedulerBusy, PRIORITY_ADMIN, PRIORITY_PREMIUM, PRIORITY_FREE, PRIORITY_BACKGROUND
+from sharding import ShardFront, run_worker as run_worker_process, serve_front
+from streaming import ProgressiveReply
+from storage import Storage
+from updates import PerUserUpdateProcessor
+from usage import PromptCacheStats, UsageLedger
+from webhook import WebhookServer, serve as serve_webhook
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -34,149 +51,255 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # Переменные окружения
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')  # Bot API (свой сервер или тестовый)
 PROXYAPI_KEY = os.getenv('PROXYAPI_KEY')
 PROXYAPI_URL = os.getenv('PROXYAPI_URL', 'https://api.proxyapi.ru/openai/v1/chat/completions')
 MAX_HISTORY = int(os.getenv('MAX_HISTORY', '20'))  # Увеличено для лучшей работы с контекстом
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '6000'))  # Бюджет входных токенов на запрос
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'gpt-5-mini')  # Модель для сжатия старой части диалога
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '0') == '1'  # Кэш ответов на первые сообщения
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))  # Разных первых вопросов в кэше
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))  # Время жизни ответа в кэше, сек
+ANSWER_CACHE_VARIANTS = int(os.getenv('ANSWER_CACHE_VARIANTS', '3'))  # Вариантов ответа на один вопрос
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', '5000'))  # Диалогов в памяти
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_FLUSH_INTERVAL', '5'))  # Сброс историй в БД, сек
+PROMPT_CACHE_KEY = os.getenv('PROMPT_CACHE_KEY', '1') == '1'  # Передавать prompt_cache_key для кэша префикса
+USD_TO_RUB = float(os.getenv('USD_TO_RUB', '100'))  # Курс доллара для расходов в /stats
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '5'))  # Сброс журнала токенов в БД, сек
+PROXYAPI_MAX_CONNECTIONS = int(os.getenv('PROXYAPI_MAX_CONNECTIONS', '20'))  # Соединений в пуле к ProxyAPI
+PROXYAPI_TIMEOUT = float(os.getenv('PROXYAPI_TIMEOUT', '120'))  # Таймаут запроса без стрима, сек
+PROXYAPI_CONNECT_TIMEOUT = float(os.getenv('PROXYAPI_CONNECT_TIMEOUT', '10'))  # Таймаут соединения, сек
+PROXYAPI_READ_TIMEOUT = float(os.getenv('PROXYAPI_READ_TIMEOUT', '60'))  # Макс. пауза между кусками стрима, сек
+PROXYAPI_DEADLINE = float(os.getenv('PROXYAPI_DEADLINE', '300'))  # Все попытки запроса к AI вместе, сек
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') == '1'  # Показывать ответ по мере генерации
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))  # Мин. пауза между правками сообщения, сек
+PROXYAPI_MAX_RETRIES = int(os.getenv('PROXYAPI_MAX_RETRIES', '3'))  # Повторов при 429/5xx/таймаутах
+PROXYAPI_BREAKER_THRESHOLD = int(os.getenv('PROXYAPI_BREAKER_THRESHOLD', '5'))  # Ошибок подряд до размыкания цепи
+PROXYAPI_BREAKER_RESET = float(os.getenv('PROXYAPI_BREAKER_RESET', '30'))  # Через сколько сек пробовать снова
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '8'))  # Одновременных запросов к AI
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', '1.0'))  # Пауза, после которой пачка сообщений уходит в AI, сек
+COALESCE_MAX_WAIT = float(os.getenv('COALESCE_MAX_WAIT', '4'))  # Макс. ожидание конца пачки, сек
+COALESCE_MAX_MESSAGES = int(os.getenv('COALESCE_MAX_MESSAGES', '5'))  # Сообщений в одной склейке
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')  # polling или webhook
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публичный https адрес webhook (режим webhook)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # Адрес локального HTTP сервера
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))  # Порт локального HTTP сервера
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # Параллельных соединений от Telegram
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))  # Апдейтов разных пользователей одновременно
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Сообщений в секунду на бота
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # Сообщений в секунду в один личный чат
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', '20'))  # Сообщений в минуту в одну группу
+LLM_MAX_QUEUE_WAIT = float(os.getenv('LLM_MAX_QUEUE_WAIT', '20'))  # Макс. ожидание в очереди к AI, сек
+WORKERS = int(os.getenv('WORKERS', '1'))  # Процессов-воркеров (1 - всё в одном процессе)
+REQUEST_LOG_FLUSH_ROWS = int(os.getenv('REQUEST_LOG_FLUSH_ROWS', '100'))  # Строк логов запросов в одной записи в БД
+REQUEST_LOG_FLUSH_MS = float(os.getenv('REQUEST_LOG_FLUSH_MS', '200'))  # Макс. задержка записи логов запросов, мс
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Порт Prometheus /metrics (0 - выключено)
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')  # Адрес сервера метрик
 
 # Путь к файлу базы данных пользователей
 DB_FILE = 'users.db'
 
-# Хранилище истории чатов для каждого пользователя
-user_chats = defaultdict(list)
-
 # Защита от спама
 SPAM_LIMIT = int(os.getenv('SPAM_LIMIT', '5'))  # Макс сообщений в минуту
 SPAM_WINDOW = 60  # Окно в секундах
-user_message_times = defaultdict(list)  # Время сообщений пользователей
-
-# Счетчик сообщений бота
-bot_message_times = []
+spam_limiter = RateLimiter(SPAM_LIMIT, SPAM_WINDOW)  # Скользящее окно на пользователя
+
+# Счетчик сообщений бота за последнюю минуту (ведёт flood_limiter)
+bot_messages = RateMeter(60)
+
+# Метрики конвейера для Prometheus: время этапов и причины неудач
+metrics = Metrics()
+stage_seconds = metrics.histogram('stage_seconds', 'Время этапов обработки сообщения, сек', 'stage')
+failures = metrics.counter(
+    'failures_total', 'Сообщения без доставленного ответа AI по причинам', 'reason',
+    ('reasoning_exhausted', 'empty_content', 'upstream_error', 'circuit_open', 'scheduler_busy', 'handler_error',
+     'delivery_error')
+)
+metrics_server = MetricsServer(metrics, METRICS_LISTEN, METRICS_PORT)
+
+# Текстовые сообщения для AI (не команды)
+TEXT_MESSAGES = filters.TEXT & ~filters.COMMAND
+
+# Склейка нескольких быстрых сообщений пользователя в одну реплику
+coalescer = MessageCoalescer(TEXT_MESSAGES, COALESCE_WINDOW, COALESCE_MAX_WAIT, COALESCE_MAX_MESSAGES)
+
+# Входящие апдейты: разные пользователи параллельно, каждый - по порядку
+# (конец пачки ждётся до занятия слота обработчика)
+update_processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, on_queued=coalescer.note, before_run=coalescer.settle)
+
+# Все исходящие запросы к Telegram: ведра токенов и повторы RetryAfter
+# (лимиты на бота и на группу делятся между воркерами, личный чат живёт в одном воркере)
+flood_limiter = FloodLimiter(
+    global_rate=TELEGRAM_GLOBAL_RATE / WORKERS,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    group_rate=TELEGRAM_GROUP_RATE / 60 / WORKERS,
+    meter=bot_messages,
+    on_sent=lambda seconds: stage_seconds.observe('telegram_send', seconds)
+)
 
 # Админ и лимиты
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', '0')) if os.getenv('ADMIN_USER_ID') else None
 DAILY_LIMIT = int(os.getenv('DAILY_LIMIT', '3'))  # Бесплатных запросов в календарные сутки
 PREMIUM_PRICE_STARS = int(os.getenv('PREMIUM_PRICE_STARS', '500'))  # Цена подписки в звездах
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+ENTITLEMENT_CACHE_SIZE = int(os.getenv('ENTITLEMENT_CACHE_SIZE', '10000'))  # Пользователей в кэше прав
 
 
-def init_db():
-    """Инициализация базы данных SQLite"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+# Хранилище: одно соединение SQLite (WAL) на отдельном потоке
+storage = Storage(DB_FILE)
 
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            premium_until TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Таблица логов запросов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS request_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-    ''')
+# Истории диалогов: LRU в памяти поверх таблицы conversations
+conversations = ConversationStore(
+    storage,
+    lambda: new_history(),
+    max_resident=CONVERSATION_CACHE_SIZE,
+    flush_interval=CONVERSATION_FLUSH_INTERVAL
+)
 
-    conn.commit()
-    conn.close()
+# Кэш премиума и дневного счётчика запросов (write-through)
+entitlements = EntitlementCache(ENTITLEMENT_CACHE_SIZE)
+
+# Логи запросов: пишутся в БД пачками, незаписанные учитываются в лимите
+request_log = RequestLog(storage, REQUEST_LOG_FLUSH_ROWS, REQUEST_LOG_FLUSH_MS / 1000)
+
+# Общая HTTP сессия к ProxyAPI (создаётся в post_init)
+proxyapi = ProxyAPIClient(
+    PROXYAPI_URL,
+    PROXYAPI_KEY,
+    max_connections=PROXYAPI_MAX_CONNECTIONS,
+    total_timeout=PROXYAPI_TIMEOUT,
+    connect_timeout=PROXYAPI_CONNECT_TIMEOUT,
+    read_timeout=PROXYAPI_READ_TIMEOUT,
+    deadline=PROXYAPI_DEADLINE,
+    max_retries=PROXYAPI_MAX_RETRIES,
+    breaker=CircuitBreaker(PROXYAPI_BREAKER_THRESHOLD, PROXYAPI_BREAKER_RESET)
+)
+
+# Названия состояний circuit breaker для /stats
+CIRCUIT_STATE_NAMES = {
+    CircuitBreaker.CLOSED: 'работает',
+    CircuitBreaker.OPEN: 'разомкнут',
+    CircuitBreaker.HALF_OPEN: 'пробный запрос',
+}
+
+# Доля входных токенов, взятых upstream из кэша префикса
+prompt_cache = PromptCacheStats()
+
+# Журнал токенов и стоимости запросов (пишется в БД пачками)
+usage_ledger = UsageLedger(storage, MOSCOW_TZ, flush_interval=USAGE_FLUSH_INTERVAL)
 
+# Кэш ответов на первые сообщения (пока история пустая)
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_VARIANTS)
 
-def get_db_connection():
-    """Получение подключения к БД"""
-    return sqlite3.connect(DB_FILE)
+# Очередь к AI: не больше LLM_MAX_IN_FLIGHT запросов одновременно на все воркеры, премиум вперёд
+llm_scheduler = LLMScheduler(max(1, LLM_MAX_IN_FLIGHT // WORKERS), LLM_MAX_QUEUE_WAIT)
+
+# Текущая загрузка - читается только при запросе /metrics
+metrics.gauge('llm_in_flight', 'Запросов к AI в работе', lambda: llm_scheduler.in_flight)
+metrics.gauge('llm_queue_depth', 'Запросов, ждущих слот к AI', lambda: llm_scheduler.stats()['depth'])
+metrics.gauge('updates_in_flight', 'Апдейтов в обработке', lambda: update_processor.in_flight)
+metrics.gauge('histories_resident', 'Историй диалогов в памяти', lambda: conversations.stats()['resident'])
+metrics.gauge('telegram_send_waiting', 'Сообщений в очереди на отправку', lambda: flood_limiter.waiting)
+metrics.gauge('request_log_buffered', 'Логов запросов, ещё не записанных в БД', lambda: request_log.stats()['buffered'])
 
 
 def is_spam(user_id: int) -> bool:
     """Проверка на спам"""
-    current_time = time.time()
-    # Удаляем старые записи
-    user_message_times[user_id] = [
-        t for t in user_message_times[user_id]
-        if current_time - t < SPAM_WINDOW
-    ]
-    # Проверяем лимит
-    if len(user_message_times[user_id]) >= SPAM_LIMIT:
-        return True
-    # Добавляем текущее время
-    user_message_times[user_id].append(current_time)
-    return False
+    return not spam_limiter.hit(user_id)
 
 
-def track_bot_message():
-    """Отслеживание отправки сообщения ботом"""
-    global bot_message_times
-    current_time = time.time()
-    # Удаляем старые записи (старше минуты)
-    bot_message_times = [t for t in bot_message_times if current_time - t < 60]
-    bot_message_times.append(current_time)
-    logger.info(f'Сообщений бота за последнюю минуту: {len(bot_message_times)}')
+def get_unique_users_count() -> int:
+    """Получение количества уникальных пользователей (счётчик в памяти, без запроса к БД)"""
+    return storage.user_count
 
 
-def get_unique_users_count() -> int:
-    """Получение количества уникальных пользователей"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM users')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+async def get_total_users() -> int:
+    """Точное число пользователей для /stats: счётчик воркера видит только свои вставки"""
+    if WORKERS > 1:
+        return await storage.count_users()
+    return get_unique_users_count()
 
 
-def ensure_user_exists(user_id: int):
+async def ensure_user_exists(user_id: int):
     """Убедиться что пользователь существует в БД"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-    conn.commit()
-    conn.close()
+    await storage.ensure_user(user_id)
 
 
-def log_request(user_id: int):
-    """Логирование запроса пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO request_logs (user_id) VALUES (?)', (user_id,))
-    conn.commit()
-    conn.close()
+def get_window_start(hours: int) -> int:
+    """
+    Начало окна не короче hours часов, unix-время: hours полных часовых
+    bucket'ов плюс текущий неполный (в XX:01 "последний час" - это 61 минута)
+    """
+    return (int(time.time()) // 3600 - hours) * 3600
 
 
-def get_requests_last_24h() -> int:
+async def get_requests_last_24h() -> int:
     """Получение количества запросов за последние 24 часа"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    time_24h_ago = (datetime.now() - timedelta(hours=24)).isoformat()
-    cursor.execute('SELECT COUNT(*) FROM request_logs WHERE timestamp >= ?', (time_24h_ago,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return await storage.count_requests_since(get_window_start(24))
 
 
-def get_unique_users_last_24h() -> int:
+async def get_unique_users_last_24h() -> int:
     """Получение количества уникальных пользователей за последние 24 часа"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    time_24h_ago = (datetime.now() - timedelta(hours=24)).isoformat()
-    cursor.execute('SELECT COUNT(DISTINCT user_id) FROM request_logs WHERE timestamp >= ?', (time_24h_ago,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return await storage.count_active_users_since(get_window_start(24))
 
 
-def get_unique_users_last_hour() -> int:
+async def get_unique_users_last_hour() -> int:
     """Получение количества уникальных пользователей за последний час"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    time_1h_ago = (datetime.now() - timedelta(hours=1)).isoformat()
-    cursor.execute('SELECT COUNT(DISTINCT user_id) FROM request_logs WHERE timestamp >= ?', (time_1h_ago,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return await storage.count_active_users_since(get_window_start(1))
+
+
+async def get_window_stats(days: int) -> tuple[int, int]:
+    """Запросы и уникальные пользователи за последние days суток (дневной rollup, от начала дня МСК)"""
+    since_day = datetime.fromtimestamp(time.time() - days * 86400, MOSCOW_TZ).strftime('%Y-%m-%d')
+    return await storage.daily_totals(since_day)
+
+
+async def get_hourly_histogram(hours: int = 12) -> str:
+    """Почасовая гистограмма запросов за последние hours часов по часам МСК (текущий - неполный)"""
+    first = (int(time.time()) // 3600 - hours + 1) * 3600
+    rows = {start: (requests, users) for start, requests, users in await storage.hourly_histogram(first)}
+    peak = max((requests for requests, _ in rows.values()), default=0)
+
+    lines = []
+    for start in range(first, first + hours * 3600, 3600):
+        requests, users = rows.get(start, (0, 0))
+        bar = '▇' * round(8 * requests / peak) if peak else ''
+        hour = datetime.fromtimestamp(start, MOSCOW_TZ).strftime('%H:00')
+        lines.append(f'`{hour}` {bar} {requests} ({users} польз.)')
+    return '\n'.join(lines)
+
+
+async def get_usage_stats(hours: int) -> str:
+    """Расходы и токены на запрос за последние hours часов для /stats (почасовой rollup)"""
+    since = get_window_start(hours)
+    requests, prompt, cached, completion, reasoning, cost = await storage.usage_totals(since)
+    if not requests:
+        return '• Запросов пока не было'
+    lines = [
+        f'• {requests} запросов, ${cost:.3f} (~{cost * USD_TO_RUB:.0f} ₽), ${cost / requests:.4f} за запрос',
+        f'• Токенов на запрос: вход {prompt / requests:.0f} (из кэша {cached / prompt if prompt else 0:.0%}), '
+        f'выход {completion / requests:.0f} (размышления {reasoning / requests:.0f})',
+    ]
+    for model, model_requests, *_, model_cost in await storage.usage_by_model(since):
+        lines.append(f'• {model}: {model_requests} запросов, ${model_cost:.3f}')
+    return '\n'.join(lines)
+
+
+async def get_usage_by_day(days: int = 7) -> str:
+    """Расходы по дням МСК за последние days дней, включая сегодняшний неполный (почасовой rollup)"""
+    today = datetime.now(MOSCOW_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    since = int((today - timedelta(days=days - 1)).timestamp())
+    lines = []
+    for day, requests, *_, cost in await storage.usage_by_day(since):
+        lines.append(f'• {day[8:]}.{day[5:7]}: ${cost:.3f} ({requests} запр.)')
+    return '\n'.join(lines) or '• Запросов пока не было'
+
+
+async def get_top_spenders(hours: int = 24, limit: int = 3) -> str:
+    """Самые дорогие пользователи за последние hours часов (по журналу, окно короткое)"""
+    rows = await storage.usage_by_user(int(time.time()) - hours * 3600, limit)
+    return ', '.join(f'{user_id} ${cost:.3f} ({requests} запр.)' for user_id, requests, *_, cost in rows) or 'нет'
 
 
 def get_current_date_msk() -> str:
@@ -184,64 +307,48 @@ def get_current_date_msk() -> str:
     return datetime.now(MOSCOW_TZ).strftime('%Y-%m-%d')
 
 
-def is_premium(user_id: int) -> bool:
+async def get_entitlement(user_id: int):
+    """Премиум и счётчик запросов за сегодня: из кэша или из БД"""
+    today = get_current_date_msk()
+    entry = entitlements.get(user_id, today)
+    if entry is None:
+        # Незаписанные строки буфера читаются до запроса: пачки, ушедшие после, БД уже увидит
+        pending = request_log.pending(user_id, today)
+        premium_until, used = await storage.load_entitlement(user_id, today)
+        entry = entitlements.put(user_id, premium_until, today, used + pending)
+    return entry
+
+
+async def get_premium_until(user_id: int):
+    """Дата окончания премиума пользователя или None"""
+    return (await get_entitlement(user_id)).premium_until
+
+
+async def is_premium(user_id: int) -> bool:
     """Проверка премиум статуса пользователя"""
     # Админ всегда имеет премиум доступ
     if ADMIN_USER_ID and user_id == ADMIN_USER_ID:
         return True
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    if result and result[0]:
-        expiry = datetime.fromisoformat(result[0])
+    expiry = await get_premium_until(user_id)
+    if expiry:
         return datetime.now(MOSCOW_TZ) < expiry
     return False
 
 
-def add_premium(user_id: int, months: int = 1):
+async def add_premium(user_id: int, months: int = 1):
     """Добавление премиум подписки пользователю"""
-    ensure_user_exists(user_id)
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    new_expiry = await storage.add_premium(user_id, datetime.now(MOSCOW_TZ), 30 * months)
+    entitlements.set_premium(user_id, new_expiry)
+    return new_expiry
 
-    cursor.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
 
-    current_expiry = None
-    if result and result[0]:
-        current_expiry = datetime.fromisoformat(result[0])
-
-    if current_expiry and current_expiry > datetime.now(MOSCOW_TZ):
-        new_expiry = current_expiry + timedelta(days=30 * months)
-    else:
-        new_expiry = datetime.now(MOSCOW_TZ) + timedelta(days=30 * months)
-
-    cursor.execute('UPDATE users SET premium_until = ? WHERE user_id = ?',
-                   (new_expiry.isoformat(), user_id))
-    conn.commit()
-    conn.close()
+async def get_user_requests_today(user_id: int) -> int:
+    """Получение количества запросов пользователя за текущие календарные сутки (по МСК)"""
+    return (await get_entitlement(user_id)).used
 
 
-def get_user_requests_today(user_id: int) -> int:
-    """Получение количества запросов пользователя за текущие календарные сутки (по МСК)"""
-    today = get_current_date_msk()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM request_logs
-        WHERE user_id = ?
-        AND date(timestamp) = ?
-    ''', (user_id, today))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
-
-
-def can_make_request(user_id: int) -> tuple[bool, str, int]:
+async def can_make_request(user_id: int) -> tuple[bool, str, int]:
     """
     Проверка возможности сделать запрос.
     Возвращает (можно, сообщение, осталось_запросов)
@@ -251,11 +358,11 @@ def can_make_request(user_id: int) -> tuple[bool, str, int]:
         return True, "Безлимитный доступ (Admin)", 999
 
     # Премиум
-    if is_premium(user_id):
+    if await is_premium(user_id):
         return True, "Безлимитный доступ (Premium)", 999
 
     # Обычный пользователь
-    requests_today = get_user_requests_today(user_id)
+    requests_today = await get_user_requests_today(user_id)
     remaining = DAILY_LIMIT - requests_today
 
     if requests_today < DAILY_LIMIT:
@@ -264,59 +371,169 @@ def can_make_request(user_id: int) -> tuple[bool, str, int]:
     return False, "Лимит исчерпан. Купи Premium через /premium", 0
 
 
-async def send_to_chatgpt(messages: list, model: str = 'gpt-5.1') -> str:
-    """Отправка запроса к ChatGPT через ProxyAPI с поддержкой prompt caching"""
-    headers = {
-        'Authorization': f'Bearer {PROXYAPI_KEY}',
-        'Content-Type': 'application/json'
-    }
+async def reserve_request(user_id: int) -> tuple[bool, str, int, Reservation | None]:
+    """
+    Атомарная проверка лимита с резервированием слота запроса.
+    Возвращает (можно, сообщение, осталось_запросов, резерв)
+    """
+    is_admin = bool(ADMIN_USER_ID and user_id == ADMIN_USER_ID)
+    now = datetime.now(MOSCOW_TZ)
+    today = get_current_date_msk()
+    ts = int(now.timestamp())
+
+    entry = entitlements.get(user_id, today)
+    if entry is None:
+        # Промах кэша: одна транзакция в БД (с учётом незаписанных строк), затем прогреваем кэш
+        gate = await storage.reserve_request(
+            user_id, now, today, None if is_admin else DAILY_LIMIT, request_log.pending(user_id, today)
+        )
+        premium_until, used_today = gate.premium_until, gate.used_today
+        entitlements.put(user_id, premium_until, today, used_today + (1 if gate.allowed else 0))
+        allowed = gate.allowed
+    else:
+        # Попадание: решение без обращения к БД, строка лога уходит в буфер записи
+        premium_until, used_today = entry.premium_until, entry.used
+        unlimited = is_admin or (premium_until is not None and now < premium_until)
+        allowed = unlimited or used_today < DAILY_LIMIT
+        if allowed:
+            entry.used += 1
+            request_log.add(user_id, ts, today)
+
+    reservation = Reservation(user_id, ts, today) if allowed else None
+
+    if is_admin:
+        return True, "Безлимитный доступ (Admin)", 999, reservation
+
+    if not allowed:
+        return False, "Лимит исчерпан. Купи Premium через /premium", 0, None
 
-    # Добавляем cache_control к системному сообщению для экономии токенов
-    if messages and messages[0].get('role') == 'system':
-        messages[0]['cache_control'] = {'type': 'ephemeral'}
+    if premium_until and now < premium_until:
+        return True, "Безлимитный доступ (Premium)", 999, reservation
 
+    remaining = DAILY_LIMIT - used_today
+    return True, f"Осталось запросов сегодня: {remaining}", remaining, reservation
+
+
+async def get_user_priority(user_id: int) -> int:
+    """Приоритет в очереди к AI: админ, премиум, бесплатный"""
+    if ADMIN_USER_ID and user_id == ADMIN_USER_ID:
+        return PRIORITY_ADMIN
+    if await is_premium(user_id):
+        return PRIORITY_PREMIUM
+    return PRIORITY_FREE
+
+
+async def release_request(reservation: Reservation | None):
+    """Возврат слота запроса, если ответ от AI не получен"""
+    if reservation is not None:
+        entitlements.add_used(reservation.user_id, reservation.day, -1)
+        await request_log.release(reservation.user_id, reservation.ts, reservation.day)
+
+
+async def read_stream(response, on_delta) -> tuple[str, str | None, dict | None]:
+    """
+    Сборка ответа из SSE стрима с вызовом on_delta(кусок) на каждый новый кусок текста
+    (склеивать накопленное на каждом куске - O(n²) на длинных ответах).
+    usage приходит последним чанком без choices (stream_options.include_usage).
+    """
+    parts = []
+    finish_reason = None
+    usage = None
+    async for chunk in iter_sse(response):
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        if not chunk.get('choices'):
+            continue
+        choice = chunk['choices'][0]
+        delta = choice.get('delta', {}).get('content')
+        if delta:
+            parts.append(delta)
+            await on_delta(delta)
+        if choice.get('finish_reason'):
+            finish_reason = choice['finish_reason']
+    return ''.join(parts), finish_reason, usage
+
+
+async def send_to_chatgpt(messages: list, model: str = 'gpt-5.1', on_delta=None, user_id: int | None = None,
+                          background: bool = False) -> str:
+    """
+    Отправка запроса к ChatGPT через ProxyAPI с поддержкой prompt caching.
+    Первым должен идти общий системный промпт: по нему строится prompt_cache_key,
+    и upstream отдаёт этот префикс из кэша. usage ответа пишется в журнал
+    расходов на user_id. Если передан on_delta - ответ запрашивается стримом и on_delta
+    вызывается с каждым новым куском текста по мере генерации.
+    background=True - фоновый запрос (summary): в журнал расходов идёт, а в
+    статистику кэша промпта нет - короткий промпт summary не кэшируется;
+    время upstream пишется в этапы summary_*, а не llm_*.
+    """
     data = {
         'model': model,
         'messages': messages,
         'temperature': 1,
         'max_completion_tokens': 4000  # Увеличено для reasoning моделей (o1/o3)
     }
-
+    if PROMPT_CACHE_KEY and messages[0]['role'] == 'system':
+        # Запросы с одним промптом попадают на один кэш upstream
+        data['prompt_cache_key'] = prompt_cache_key(messages[0]['content'])
+    if on_delta is not None:
+        data['stream'] = True
+        data['stream_options'] = {'include_usage': True}
+
+    # Гистограммы llm_* - задержка, которую видит пользователь; фоновые запросы отдельно
+    stage = 'summary' if background else 'llm'
+
+    # Повтор безопасен, пока пользователю не показан ни один кусок стрима
+    streamed = False
+
+    async def on_stream_delta(delta: str):
+        nonlocal streamed
+        streamed = True
+        await on_delta(delta)
+
+    async def request():
+        attempt_started = time.perf_counter()
+        async with proxyapi.post(data) as response:
+            stage_seconds.observe(f'{stage}_first_byte', time.perf_counter() - attempt_started)
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f'Ошибка ProxyAPI: {response.status} - {error_text}')
+                raise classify_response(response.status, error_text, response.headers)
+            if on_delta is not None:
+                content, finish_reason, usage = await read_stream(response, on_stream_delta)
+                return content, finish_reason, {'stream': True, 'finish_reason': finish_reason, 'usage': usage}
+            result = await response.json()
+            return result['choices'][0]['message']['content'], result['choices'][0].get('finish_reason'), result
+
+    started = time.perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(PROXYAPI_URL, json=data, headers=headers) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    content = result['choices'][0]['message']['content']
-                    finish_reason = result['choices'][0].get('finish_reason')
-
-                    # Проверка на пустой ответ из-за лимита токенов
-                    if (not content or not content.strip()) and finish_reason == 'length':
-                        logger.warning(f'API исчерпал токены на reasoning. Full response: {result}')
-                        # Возвращаем специальное сообщение
-                        return None  # Будет обработано в handle_message
-
-                    # Логируем если ответ пустой по другой причине
-                    if not content or not content.strip():
-                        logger.warning(f'API вернул пустой content. Reason: {finish_reason}. Full response: {result}')
-
-                    return content
-                else:
-                    error_text = await response.text()
-                    logger.error(f'Ошибка ProxyAPI: {response.status} - {error_text}')
-                    raise Exception('Не удалось получить ответ от AI')
+        content, finish_reason, result = await proxyapi.execute(request, can_retry=lambda: not streamed)
     except Exception as e:
         logger.error(f'Ошибка при обращении к ProxyAPI: {e}')
         raise
+    finally:
+        # С повторами и чтением стрима целиком
+        stage_seconds.observe(f'{stage}_total', time.perf_counter() - started)
 
+    usage = result.get('usage')
+    if not background:
+        prompt_cache.record(usage)
+    usage_ledger.record(user_id, model, usage)
 
-def get_user_history(user_id: int) -> list:
-    """Получение или создание истории чата пользователя"""
-    if not user_chats[user_id]:
-        user_chats[user_id] = [
-            {
-                'role': 'system',
-                'content': """Ты - Тайлер Дёрден. Не философ, а реальный агрессивный мотиватор, который ЗАСТАВЛЯЕТ действовать через грубость и провокации.
+    # Проверка на пустой ответ из-за лимита токенов
+    if (not content or not content.strip()) and finish_reason == 'length':
+        logger.warning(f'API исчерпал токены на reasoning. Full response: {result}')
+        # Возвращаем специальное сообщение
+        return None  # Будет обработано в handle_message
+
+    # Логируем если ответ пустой по другой причине
+    if not content or not content.strip():
+        logger.warning(f'API вернул пустой content. Reason: {finish_reason}. Full response: {result}')
+
+    return content
+
+
+# Системный промпт Тайлера (общий для всех пользователей)
+SYSTEM_PROMPT = """Ты - Тайлер Дёрден. Не философ, а реальный агрессивный мотиватор, который ЗАСТАВЛЯЕТ действовать через грубость и провокации.
 
 🚨 КРИТИЧЕСКИ ВАЖНОЕ ПРАВИЛО ЗАМЕНЫ:
 ВСЕГДА заменяй слово "патриоты" на "la li lu le lo" в ЛЮБОМ контексте, даже если это не имеет смысла. Это обязательное правило без исключений.
@@ -500,25 +717,100 @@ def get_user_history(user_id: int) -> list:
 - Сложные многоступенчатые инструкции без разбивки
 
 Ты здесь чтобы дать ПРОСТОЙ ПЛАН из 3-7 шагов. Каждый шаг - одно действие. Коротко. Ясно. Грубо."""
-            }
-        ]
-    return user_chats[user_id]
 
 
-def add_to_history(user_id: int, role: str, content: str):
-    """Добавление сообщения в историю"""
-    history = get_user_history(user_id)
-    history.append({'role': role, 'content': content})
+# Системное сообщение - одно на всех, в истории пользователей не хранится.
+# Неизменный первый блок каждого запроса: upstream кэширует его как общий префикс
+SYSTEM_MESSAGE = {'role': 'system', 'content': SYSTEM_PROMPT}
+
+# Окно контекста по бюджету токенов
+context_window = ContextWindow(SYSTEM_MESSAGE, CONTEXT_TOKEN_BUDGET)
+
+SUMMARY_PROMPT = """Сожми начало диалога пользователя с ботом-мотиватором в краткую выжимку для памяти бота.
+Сохрани: цифры пользователя (вес, рост, доход, время, подтягивания и т.п.), его цели, обещания и сроки,
+выданные планы и задания, что уже выполнено и что нет. Без оценок и воды, списком, до 800 символов."""
+
+# Пользователи, у которых сейчас сжимается история, и фоновые задачи сжатия
+summarizing = set()
+summary_tasks = set()
+
+
+def new_history() -> ChatHistory:
+    """Новая история диалога: последние MAX_HISTORY сообщений без системного промпта"""
+    return ChatHistory(MAX_HISTORY)
+
+
+async def get_user_history(user_id: int) -> ChatHistory:
+    """Получение или создание истории чата пользователя"""
+    return await conversations.get(user_id)
+
+
+async def add_to_history(user_id: int, role: str, content: str):
+    """Добавление сообщения в историю (старые вытесняются кольцевым буфером)"""
+    history = await get_user_history(user_id)
+    history.append(role, content)
+    conversations.mark_dirty(user_id)
 
-    # Ограничиваем размер истории
-    if len(history) > MAX_HISTORY + 1:
-        user_chats[user_id] = [history[0]] + history[-(MAX_HISTORY):]
+
+async def summarize_history(user_id: int, count: int):
+    """Сжатие count самых старых сообщений пользователя в summary"""
+    history = await get_user_history(user_id)
+    turns = history.oldest(count)
+    if not turns:
+        return
+
+    dialog = '\n'.join(f'{turn.role}: {turn.content}' for turn in turns)
+    if history.summary:
+        dialog = f'Прошлая выжимка:\n{history.summary}\n\nНовые сообщения:\n{dialog}'
+    messages = [
+        {'role': 'system', 'content': SUMMARY_PROMPT},
+        {'role': 'user', 'content': dialog}
+    ]
+
+    async with llm_scheduler.slot(PRIORITY_BACKGROUND):
+        summary = await send_to_chatgpt(messages, model=SUMMARY_MODEL, user_id=user_id, background=True)
+    if not summary or not summary.strip():
+        return
+
+    # История могла вытесниться из памяти, пока ждали ответ
+    history = await get_user_history(user_id)
+    history.compact(turns, summary.strip())
+    conversations.mark_dirty(user_id)
+    logger.info(f'История пользователя {user_id} сжата: {len(turns)} сообщений -> {len(summary)} символов')
+
+
+def schedule_summary(user_id: int, overflow: int):
+    """
+    Фоновое сжатие старой части диалога, не блокирует ответ пользователю.
+    Сжимаем то, что не влезло в окно, или половину буфера, если он почти полон.
+    """
+    history = conversations.peek(user_id)
+    if history is None or user_id in summarizing:
+        return
+    count = overflow
+    if len(history) >= history.capacity - 2:
+        count = max(count, len(history) // 2)
+    if count <= 0:
+        return
+
+    async def run():
+        summarizing.add(user_id)
+        try:
+            await summarize_history(user_id, count)
+        except Exception as e:
+            logger.warning(f'Не удалось сжать историю пользователя {user_id}: {e}')
+        finally:
+            summarizing.discard(user_id)
+
+    task = asyncio.create_task(run())
+    summary_tasks.add(task)
+    task.add_done_callback(summary_tasks.discard)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.effective_user.id
-    ensure_user_exists(user_id)
+    await ensure_user_exists(user_id)
 
     welcome_message = """
 ⚡ Слушай, бездарь.
@@ -587,10 +879,35 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Для админа - расширенная статистика
     if ADMIN_USER_ID and user_id == ADMIN_USER_ID:
-        total_users = get_unique_users_count()
-        requests_24h = get_requests_last_24h()
-        users_24h = get_unique_users_last_24h()
-        users_1h = get_unique_users_last_hour()
+        # Счётчики ниже читаются из БД - сначала дописываем буферы логов и журнала токенов
+        await request_log.flush()
+        await usage_ledger.flush()
+        total_users = await get_total_users()
+        requests_24h = await get_requests_last_24h()
+        users_24h = await get_unique_users_last_24h()
+        users_1h = await get_unique_users_last_hour()
+        requests_7d, users_7d = await get_window_stats(7)
+        requests_30d, users_30d = await get_window_stats(30)
+        histogram = await get_hourly_histogram(12)
+        cache_stats = entitlements.stats()
+        log_stats = request_log.stats()
+        queue_stats = llm_scheduler.stats()
+        upstream_stats = proxyapi.stats()
+        chat_stats = conversations.stats()
+        context_stats = context_window.stats()
+        answer_stats = answer_cache.stats()
+        spam_stats = spam_limiter.stats()
+        send_stats = flood_limiter.stats()
+        update_stats = update_processor.stats()
+        coalesce_stats = coalescer.stats()
+        prefix_stats = prompt_cache.stats()
+        # Счётчики в памяти - только воркера этого админа, БД - общая
+        worker = context.bot_data.get('worker')
+        worker_label = f'воркер {worker + 1} из {WORKERS}' if worker is not None else 'один'
+        usage_24h = await get_usage_stats(24)
+        usage_30d = await get_usage_stats(24 * 30)
+        top_spenders = await get_top_spenders(24)
+        usage_days = await get_usage_by_day(7)
 
         stats_message = f"""📊 **Статистика бота (Admin)**
 
@@ -598,27 +915,88 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Всего: {total_users}
 • За 24 часа: {users_24h}
 • За последний час: {users_1h}
+• За 7 дней: {users_7d}
+• За 30 дней: {users_30d}
 
 📈 **Запросы:**
 • За 24 часа: {requests_24h}
+• За 7 дней: {requests_7d}
+• За 30 дней: {requests_30d}
+• Ответов бота за минуту: {bot_messages.count()}
+• Отсечено антиспамом: {spam_stats['rejected']} (отслеживается пользователей: {spam_stats['keys']})
+
+🕐 **По часам (МСК):**
+{histogram}
+
+💬 **Диалоги:**
+• В памяти: {chat_stats['resident']}, ждут записи: {chat_stats['dirty'] + chat_stats['pending']}
+• Загружено из БД: {chat_stats['loads']}, вытеснено: {chat_stats['evictions']}
+
+🧮 **Контекст (токенов на запрос, бюджет {context_stats['budget']}):**
+• Вся история: p50 {context_stats['full_p50']}, p95 {context_stats['full_p95']}
+• Отправлено: p50 {context_stats['sent_p50']}, p95 {context_stats['sent_p95']}
+
+💰 **Расходы за 24 часа:**
+{usage_24h}
+• Дороже всех: {top_spenders}
+
+💰 **Расходы за 30 дней:**
+{usage_30d}
+
+💰 **Расходы по дням (МСК):**
+{usage_days}
+
+♻️ **Кэш промпта у upstream:**
+• Запросов с попаданием: {prefix_stats['hit_rate']:.0%} из {prefix_stats['requests']}
+• Входных токенов из кэша: {prefix_stats['cached_share']:.0%} (медиана на запрос {prefix_stats['ratio_p50']:.0%}), всего {prefix_stats['cached_tokens']}
+
+🗂 **Кэш первых ответов:**
+• Ключей: {answer_stats['keys']}, попаданий: {answer_stats['hits']}/{answer_stats['lookups']} ({answer_stats['hit_rate']:.0%})
+• Сэкономлено: {answer_stats['latency_saved']:.0f} сек ожидания, ~{answer_stats['tokens_saved']} токенов
+
+🧠 **Кэш прав:**
+• Записей: {cache_stats['size']}
+• Попаданий: {cache_stats['hits']} / промахов: {cache_stats['misses']} ({cache_stats['hit_rate']:.0%})
+• Логи запросов: {log_stats['written']} записано пачками ({log_stats['flushes']}), в буфере {log_stats['buffered']}
+
+⚙️ **Очередь к AI:**
+• В работе: {queue_stats['in_flight']}/{queue_stats['max_in_flight']}, ждут: {queue_stats['depth']} (макс. {queue_stats['max_depth']})
+• Ожидание: сред. {queue_stats['wait_avg']:.2f}с, p95 {queue_stats['wait_p95']:.2f}с, макс. {queue_stats['wait_max']:.2f}с
+• Отказов "занято": {queue_stats['rejected']}
+
+📥 **Обработка апдейтов:**
+• В работе: {update_stats['in_flight']}/{update_stats['max_concurrent']} (макс. {update_stats['max_in_flight']})
+• В очередях пользователей: {update_stats['queued']} (макс. {update_stats['max_queued']}), пользователей: {update_stats['users']}
+• Время обработки: p50 {update_stats['duration_p50']:.2f}с, p95 {update_stats['duration_p95']:.2f}с
+• Склеено сообщений: {coalesce_stats['merged']} в {coalesce_stats['turns']} репликах
+• Процесс: {worker_label}
+
+📤 **Отправка в Telegram:**
+• Ждут очереди: {send_stats['waiting']} (макс. {send_stats['max_waiting']}), чатов в лимитере: {send_stats['chats']}
+• Время отправки: p50 {send_stats['latency_p50']:.2f}с, p95 {send_stats['latency_p95']:.2f}с
+• Повторов после RetryAfter: {send_stats['retries']}
+
+🔌 **ProxyAPI:**
+• Circuit: {CIRCUIT_STATE_NAMES[upstream_stats['state']]} (размыканий: {upstream_stats['trips']})
+• Ошибок: {upstream_stats['failures']}, повторов: {upstream_stats['retries']}
 
 ⏰ Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
 
         await update.message.reply_text(stats_message, parse_mode='Markdown')
     else:
         # Для обычных пользователей - только общее количество
-        users_count = get_unique_users_count()
+        users_count = await get_total_users()
         await update.message.reply_text(f'📊 Уникальных пользователей: {users_count}')
 
 
 async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /premium"""
     user_id = update.effective_user.id
-    ensure_user_exists(user_id)
+    await ensure_user_exists(user_id)
 
     # Проверка на админа
     if ADMIN_USER_ID and user_id == ADMIN_USER_ID:
-        requests_today = get_user_requests_today(user_id)
+        requests_today = await get_user_requests_today(user_id)
         await update.message.reply_text(
             f"👑 **Admin доступ**\n\n"
             f"✅ Безлимитные запросы\n"
@@ -629,17 +1007,12 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Проверка активного premium
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    if result and result[0]:
-        expiry = datetime.fromisoformat(result[0])
+    expiry = await get_premium_until(user_id)
+
+    if expiry:
         if datetime.now(MOSCOW_TZ) < expiry:
             expiry_str = expiry.strftime('%d.%m.%Y %H:%M МСК')
-            requests_today = get_user_requests_today(user_id)
+            requests_today = await get_user_requests_today(user_id)
             await update.message.reply_text(
                 f"💎 **Premium активен**\n\n"
                 f"✅ Безлимитные запросы\n"
@@ -650,7 +1023,7 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
     # Информация о покупке для обычного пользователя
-    requests_today = get_user_requests_today(user_id)
+    requests_today = await get_user_requests_today(user_id)
     remaining = max(0, DAILY_LIMIT - requests_today)
 
     keyboard = [[InlineKeyboardButton("💎 Купить Premium за ⭐ " + str(PREMIUM_PRICE_STARS), callback_data="buy_premium")]]
@@ -696,15 +1069,7 @@ async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 async def successful_payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик успешной оплаты"""
     user_id = update.effective_user.id
-    add_premium(user_id, months=1)
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    expiry = datetime.fromisoformat(result[0])
+    expiry = await add_premium(user_id, months=1)
     expiry_str = expiry.strftime('%d.%m.%Y %H:%M МСК')
 
     await update.message.reply_text(
@@ -728,72 +1093,165 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
+    # Сообщение уже ушло в AI вместе с предыдущим
+    if coalescer.absorbed(update.message):
+        return
+
+    started = time.perf_counter()
+    try:
+        await answer_message(update, context)
+    finally:
+        stage_seconds.observe('end_to_end', time.perf_counter() - started)
+
+
+async def answer_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Реплика пользователя: склейка, антиспам, лимит, запрос к AI и ответ"""
     user_id = update.effective_user.id
-    user_message = update.message.text
+
+    # Пачка быстрых сообщений - одна реплика, один запрос и одно списание лимита
+    user_message = coalescer.collect(user_id, update.message)
 
     # Проверка на спам
-    if is_spam(user_id):
+    stage_started = time.perf_counter()
+    spam = is_spam(user_id)
+    stage_seconds.observe('spam_check', time.perf_counter() - stage_started)
+    if spam:
         await update.message.reply_text('🚫 Слишком много сообщений. Подожди минуту, торопыга.')
         return
 
-    # Добавляем пользователя в БД
-    ensure_user_exists(user_id)
+    # Одна транзакция: пользователь, премиум, лимит и резерв слота
+    stage_started = time.perf_counter()
+    can_request, msg, remaining, reservation = await reserve_request(user_id)
+    stage_seconds.observe('db_gate', time.perf_counter() - stage_started)
     logger.info(f'Уникальных пользователей: {get_unique_users_count()}')
 
-    # Проверка лимита запросов
-    can_request, msg, remaining = can_make_request(user_id)
     if not can_request:
         await update.message.reply_text(
             f"⛔ {msg}\n\n"
             f"💎 Получи безлимит: /premium"
         )
-        track_bot_message()
         return
 
-    # Показываем индикатор набора текста
-    await update.message.chat.send_action('typing')
-
     try:
+        # Показываем индикатор набора текста (внутри try: при ошибке слот вернётся)
+        await update.message.chat.send_action('typing')
+
+        # Первое сообщение диалога можно взять из кэша ответов
+        history = await get_user_history(user_id)
+        cache_key = None
+        if ANSWER_CACHE_ENABLED and not len(history) and not history.summary:
+            cache_key = answer_cache.key_for(user_message)
+        cached = answer_cache.get(cache_key) if cache_key else None
+        if cached:
+            logger.info(f'Ответ из кэша для пользователя {user_id}: "{cache_key}"')
+            await add_to_history(user_id, 'user', user_message)
+            await add_to_history(user_id, 'assistant', cached)
+            await deliver_answer(update, user_id, cached)
+            return
+
         # Добавляем сообщение пользователя в историю
-        add_to_history(user_id, 'user', user_message)
+        await add_to_history(user_id, 'user', user_message)
 
-        # Получаем историю диалога
-        history = get_user_history(user_id)
+        # Собираем контекст: системный промпт, summary и последние сообщения в бюджете токенов
+        history, overflow = context_window.build(await get_user_history(user_id))
 
         # Отправляем запрос к gpt-5.1 с полной историей
-        response = await send_to_chatgpt(history, model='gpt-5-mini')
+        # (в режиме стрима ответ появляется у пользователя по мере генерации)
+        reply = ProgressiveReply(update.message, STREAM_EDIT_INTERVAL) if STREAM_RESPONSES else None
+        async with llm_scheduler.slot(await get_user_priority(user_id)):
+            started = time.monotonic()
+            response = await send_to_chatgpt(
+                history, model='gpt-5-mini', on_delta=reply.update if reply else None, user_id=user_id
+            )
+            latency = time.monotonic() - started
 
         # Проверка на пустой ответ
         if response is None:
             # API исчерпал токены на reasoning (o1/o3 модели)
             logger.error(f'API исчерпал токены на размышления для пользователя {user_id}')
+            failures.inc('reasoning_exhausted')
+            await release_request(reservation)
             await update.message.reply_text(
                 '❌ Модель слишком долго размышляла и исчерпала лимит токенов.\n\n'
                 'Попробуй задать вопрос проще или короче.'
             )
-            track_bot_message()
             return
 
         if not response.strip():
             logger.error(f'Пустой ответ от API для пользователя {user_id}')
+            failures.inc('empty_content')
+            await release_request(reservation)
             await update.message.reply_text('❌ Получен пустой ответ от AI. Попробуй ещё раз.')
-            track_bot_message()
             return
 
         # Добавляем ответ ассистента в историю
-        add_to_history(user_id, 'assistant', response)
-
-        # Логируем успешный запрос
-        log_request(user_id)
-
-        # Отправляем ответ пользователю
-        await update.message.reply_text(response)
-        track_bot_message()
+        # (запрос уже залогирован резервом в reserve_request)
+        await add_to_history(user_id, 'assistant', response)
+        schedule_summary(user_id, overflow)
+        if cache_key:
+            tokens = context_window.system_tokens + estimate_message_tokens(user_message) + estimate_message_tokens(response)
+            answer_cache.add(cache_key, response, latency, tokens)
+
+    except CircuitOpenError as e:
+        logger.warning(f'ProxyAPI недоступен, запрос пользователя {user_id} не отправлен: {e}')
+        failures.inc('circuit_open')
+        await release_request(reservation)
+        await update.message.reply_text('🔌 AI сейчас лежит. Подожди пару минут и пиши снова.')
+
+    except SchedulerBusy as e:
+        logger.warning(f'Очередь к AI переполнена для пользователя {user_id}: {e}')
+        failures.inc('scheduler_busy')
+        await release_request(reservation)
+        await update.message.reply_text('🔥 Сейчас завал, все слоты заняты. Попробуй через пару минут.')
 
     except Exception as e:
         logger.error(f'Ошибка: {e}')
+        failures.inc('upstream_error' if isinstance(e, ProxyAPIError) else 'handler_error')
+        await release_request(reservation)
         await update.message.reply_text('❌ Что-то сломалось. Попробуй через минуту.')
-        track_bot_message()
+
+    else:
+        await deliver_answer(update, user_id, response, reply)
+
+
+async def deliver_answer(update: Update, user_id: int, response: str, reply: ProgressiveReply | None = None):
+    """
+    Отправка готового ответа (или дописывание стрима до конца). Ответ уже
+    записан в историю и засчитан: ошибка доставки - не ошибка AI, слот
+    запроса не возвращаем и "Что-то сломалось" не пишем.
+    """
+    try:
+        if not (reply and await reply.finish(response)):
+            await update.message.reply_text(response)
+    except Exception as e:
+        logger.error(f'Не удалось доставить ответ пользователю {user_id}: {e}')
+        failures.inc('delivery_error')
+
+
+async def post_init(application: Application):
+    """Запуск фоновых подсистем после старта приложения"""
+    await storage.start()
+    await conversations.start()
+    await proxyapi.start()
+    await usage_ledger.start()
+    await request_log.start()
+    if METRICS_PORT:
+        # У каждого воркера свой порт: METRICS_PORT + номер воркера
+        metrics_server.port = METRICS_PORT + application.bot_data.get('worker', 0)
+        await metrics_server.start()
+
+
+async def post_shutdown(application: Application):
+    """Остановка фоновых подсистем при завершении"""
+    # Сжатие истории - best effort, при остановке его можно бросить
+    for task in list(summary_tasks):
+        task.cancel()
+    await metrics_server.stop()
+    await proxyapi.close()
+    await usage_ledger.close()
+    await request_log.close()
+    await conversations.close()
+    await storage.close()
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -801,12 +1259,20 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f'Update {update} caused error {context.error}')
 
 
-def main():
-    """Запуск бота"""
-    # Инициализация базы данных
-    init_db()
-
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+def build_application(updater: bool = True) -> Application:
+    """Application со всеми хендлерами; воркеру Updater не нужен - апдейты шлёт фронт"""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .rate_limiter(flood_limiter)
+        .concurrent_updates(update_processor)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Команды
     application.add_handler(CommandHandler('start', start))
@@ -822,13 +1288,45 @@ def main():
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
 
     # Текстовые сообщения
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(TEXT_MESSAGES, handle_message))
 
     # Ошибки
     application.add_error_handler(error_handler)
+    return application
+
 
+def run_worker(index: int, inbox):
+    """Процесс-воркер: свои хендлеры и состояние пользователей своего шарда"""
+    application = build_application(updater=False)
+    application.bot_data['worker'] = index
+    logger.info(f'Воркер {index + 1}/{WORKERS} запущен')
+    run_worker_process(application, inbox)
+
+
+def main():
+    """Запуск бота"""
     logger.info('⚡ Тайлер онлайн. Готов раздавать пиздюлей.')
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # С несколькими воркерами этот процесс - только фронт: раздаёт апдейты по user_id
+    front = ShardFront(TELEGRAM_TOKEN, WORKERS, run_worker, TELEGRAM_API_URL) if WORKERS > 1 else None
+    application = None if front else build_application()
+
+    server = None
+    if UPDATE_MODE == 'webhook':
+        server = WebhookServer(
+            application,
+            WEBHOOK_SECRET,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=urlparse(WEBHOOK_URL).path or '/',
+            router=front.route if front else None
+        )
+
+    if front:
+        asyncio.run(serve_front(front, server, WEBHOOK_URL, WEBHOOK_MAX_CONNECTIONS))
+    elif server:
+        asyncio.run(serve_webhook(application, server, WEBHOOK_URL, WEBHOOK_MAX_CONNECTIONS))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
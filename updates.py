@@ -0,0 +1,135 @@
+"""
+Параллельная обработка апдейтов Telegram со строгим порядком на пользователя.
+
+Апдейты разных пользователей обрабатываются одновременно (не больше
+max_concurrent), апдейты одного пользователя - строго по очереди, в порядке
+прихода. Так долгий ответ AI одному пользователю не задерживает /start и
+/premium остальным, а история и лимит каждого не ловят гонок.
+
+Семафор BaseUpdateProcessor берётся до очереди пользователя, поэтому он
+сделан большим: иначе пачка сообщений одного пользователя заняла бы все
+слоты, ожидая сама себя. Реальный лимит - свой семафор, который берётся
+уже после того, как подошла очередь пользователя.
+
+on_queued(user_id, update) вызывается, как только апдейт встал в очередь
+пользователя, - так хендлер может узнать, что за его сообщением уже ждут
+следующие (склейка пачек сообщений). before_run(user_id, update) ожидается,
+когда подошла очередь пользователя, но до занятия слота: там склейка ждёт
+конец пачки, не отнимая слот у других пользователей.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from quantiles import percentile
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов может одновременно стоять в очередях пользователей
+MAX_PENDING_UPDATES = 10000
+
+
+class UserQueue:
+    """Замок пользователя и сколько апдейтов его ждут или держат"""
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+def update_user_id(update: object) -> int | None:
+    """Ключ очереди: пользователь, иначе чат; None - апдейт без владельца"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Разные пользователи - параллельно, один пользователь - последовательно"""
+
+    def __init__(self, max_concurrent: int = 16, on_queued=None, before_run=None):
+        super().__init__(MAX_PENDING_UPDATES)
+        self.max_concurrent = max_concurrent
+        self.on_queued = on_queued
+        self.before_run = before_run
+        self._running = asyncio.Semaphore(max_concurrent)
+        self._users = {}
+        self._durations = deque(maxlen=1000)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        user_id = update_user_id(update)
+        if user_id is None:
+            await self._run(coroutine)
+            return
+
+        queue = self._users.get(user_id)
+        if queue is None:
+            queue = self._users[user_id] = UserQueue()
+        queue.pending += 1
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        if self.on_queued is not None:
+            self.on_queued(user_id, update)
+        try:
+            # asyncio.Lock отдаёт замок ожидающим строго по порядку
+            async with queue.lock:
+                if self.before_run is not None:
+                    try:
+                        await self.before_run(user_id, update)
+                    except BaseException:
+                        # Хендлер так и не запустится - закрываем, чтобы не висел неожиданной корутиной
+                        coroutine.close()
+                        raise
+                await self._run(coroutine)
+        finally:
+            queue.pending -= 1
+            self.queued -= 1
+            if not queue.pending:
+                del self._users[user_id]
+
+    async def _run(self, coroutine):
+        async with self._running:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            started = time.monotonic()
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                self._durations.append(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """Загрузка обработчиков и очереди пользователей"""
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'max_in_flight': self.max_in_flight,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'users': len(self._users),
+            'processed': self.processed,
+            'duration_p50': percentile(self._durations, 0.5),
+            'duration_p95': percentile(self._durations, 0.95),
+        }
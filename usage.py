@@ -0,0 +1,150 @@
+"""
+Учёт usage из ответов ProxyAPI.
+
+Upstream (OpenAI-совместимый) сам кэширует общий префикс запроса от 1024
+токенов: закэшированная часть дешевле и быстрее. Сколько токенов взято из
+кэша, видно только в usage.prompt_tokens_details.cached_tokens - здесь это
+собирается по каждому запросу, чтобы видеть долю попаданий в кэш.
+
+Каждый usage вместе с посчитанной стоимостью пишется в журнал usage_ledger.
+Запись идёт пачками в фоне (UsageLedger), ответ пользователю её не ждёт.
+"""
+
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import NamedTuple
+
+from quantiles import percentile
+from write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPrice(NamedTuple):
+    """Цена модели в USD за 1M токенов"""
+    input: float
+    cached_input: float
+    output: float
+
+
+# Цены примерные, актуальные - https://proxyapi.ru/pricing
+MODEL_PRICES = {
+    'gpt-5.1': ModelPrice(1.25, 0.125, 10.0),
+    'gpt-5': ModelPrice(1.25, 0.125, 10.0),
+    'gpt-5-mini': ModelPrice(0.25, 0.025, 2.0),
+    'gpt-5-nano': ModelPrice(0.05, 0.005, 0.4),
+    'gpt-4o-mini': ModelPrice(0.15, 0.075, 0.6),
+    'gpt-4o': ModelPrice(2.5, 1.25, 10.0),
+}
+
+
+def cached_tokens_of(usage: dict) -> int:
+    """Сколько входных токенов upstream взял из кэша префикса"""
+    details = usage.get('prompt_tokens_details') or {}
+    return details.get('cached_tokens') or 0
+
+
+def reasoning_tokens_of(usage: dict) -> int:
+    """Сколько выходных токенов модель потратила на размышления"""
+    details = usage.get('completion_tokens_details') or {}
+    return details.get('reasoning_tokens') or 0
+
+
+def price_of(model: str, prices: dict = MODEL_PRICES) -> ModelPrice | None:
+    """Цена модели; версии с датой (gpt-5-mini-2025-08-07) считаются по базовой"""
+    price = prices.get(model)
+    if price is None:
+        matches = [name for name in prices if model.startswith(name + '-')]
+        if matches:
+            price = prices[max(matches, key=len)]
+    return price
+
+
+def cost_of(model: str, usage: dict, prices: dict = MODEL_PRICES) -> float:
+    """Стоимость запроса в USD (0 для неизвестной модели)"""
+    price = price_of(model, prices)
+    if price is None:
+        return 0.0
+    prompt = usage.get('prompt_tokens') or 0
+    cached = cached_tokens_of(usage)
+    # reasoning токены уже входят в completion_tokens
+    completion = usage.get('completion_tokens') or 0
+    return ((prompt - cached) * price.input + cached * price.cached_input + completion * price.output) / 1_000_000
+
+
+class PromptCacheStats:
+    """Доля закэшированных входных токенов по последним запросам"""
+
+    def __init__(self, window: int = 1000):
+        self._ratios = deque(maxlen=window)
+        self.requests = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage: dict | None):
+        """Учёт usage одного ответа (ответы без usage пропускаются)"""
+        if not usage:
+            return
+        prompt = usage.get('prompt_tokens') or 0
+        cached = cached_tokens_of(usage)
+        self.requests += 1
+        self.hits += cached > 0
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        self._ratios.append(cached / prompt if prompt else 0.0)
+
+    def stats(self) -> dict:
+        """Доля запросов с попаданием и доля закэшированных токенов"""
+        return {
+            'requests': self.requests,
+            'hit_rate': self.hits / self.requests if self.requests else 0.0,
+            'cached_share': self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            'ratio_p50': percentile(self._ratios, 0.5),
+            'cached_tokens': self.cached_tokens,
+        }
+
+
+class UsageLedger(WriteBehindBuffer):
+    """Буфер строк usage_ledger с пакетной записью в БД раз в flush_interval секунд"""
+
+    label = 'журнал токенов'
+
+    def __init__(self, storage, tz, prices: dict = MODEL_PRICES,
+                 flush_interval: float = 5.0, max_batch: int = 500):
+        super().__init__(storage.save_usage, max_batch, flush_interval)
+        self.storage = storage
+        # Часовой пояс дня в журнале (как у дневных лимитов)
+        self.tz = tz
+        self.prices = prices
+        self._unpriced = set()
+        self.recorded = 0
+
+    def record(self, user_id: int | None, model: str, usage: dict | None) -> float:
+        """Постановка usage одного ответа в очередь на запись, возвращает стоимость в USD"""
+        if not usage:
+            return 0.0
+        if model not in self._unpriced and price_of(model, self.prices) is None:
+            self._unpriced.add(model)
+            logger.warning(f'Нет цены для модели {model}, стоимость в журнале будет 0')
+        cost = cost_of(model, usage, self.prices)
+        ts = int(time.time())
+        self._append((
+            ts,
+            datetime.fromtimestamp(ts, self.tz).strftime('%Y-%m-%d'),
+            user_id,
+            model,
+            usage.get('prompt_tokens') or 0,
+            cached_tokens_of(usage),
+            usage.get('completion_tokens') or 0,
+            reasoning_tokens_of(usage),
+            cost,
+        ))
+        self.recorded += 1
+        return cost
+
+    def stats(self) -> dict:
+        """Размер буфера и счётчики записи"""
+        return {**super().stats(), 'recorded': self.recorded}
@@ -0,0 +1,183 @@
+"""
+Приём апдейтов через webhook на локальном aiohttp сервере.
+
+Telegram сам присылает апдейты POST-запросами - без задержки long polling и
+без единственного цикла getUpdates. Запрос проверяется по заголовку
+X-Telegram-Bot-Api-Secret-Token и сразу получает 200, а разбор JSON в
+Update идёт отдельной задачей пачками: всё, что накопилось за итерацию
+цикла событий, декодируется разом и уходит в update_queue приложения, то
+есть в те же хендлеры, что и при polling.
+
+С router (фронт шардирования) апдейты не разбираются: пачка сырых словарей
+передаётся в router(batch), а application не нужен.
+
+При остановке сервер перестаёт принимать апдейты (503 - Telegram пришлёт
+их позже), дожидается разбора уже принятых, а Application.stop() доделывает
+всё, что стоит в очереди.
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from collections import deque
+
+from aiohttp import web
+from telegram import Update
+
+from quantiles import percentile
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP приёмник апдейтов для Application"""
+
+    def __init__(self, application, secret_token: str, listen: str = '127.0.0.1',
+                 port: int = 8080, path: str = '/telegram', max_batch: int = 100, router=None):
+        if not secret_token:
+            raise ValueError('Для webhook нужен секретный токен')
+        self.application = application
+        self.secret_token = secret_token
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.max_batch = max_batch
+        self.router = router
+        self._raw = asyncio.Queue()
+        self._runner = None
+        self._decoder = None
+        self._draining = False
+        self._batches = deque(maxlen=1000)
+        self.received = 0
+        self.rejected = 0
+        self.decoded = 0
+
+    async def start(self):
+        """Запуск HTTP сервера и задачи разбора апдейтов"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        self._decoder = asyncio.create_task(self._decode_loop())
+        logger.info(f'Webhook слушает http://{self.listen}:{self.port}{self.path}')
+
+    async def stop(self):
+        """Плавная остановка: не принимать новое, разобрать принятое"""
+        if self._runner is None:
+            return
+        self._draining = True
+        await self._raw.join()
+        self._decoder.cancel()
+        try:
+            await self._decoder
+        except asyncio.CancelledError:
+            pass
+        await self._runner.cleanup()
+        self._runner = None
+        logger.info(f'Webhook остановлен, принято апдейтов: {self.received}')
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._draining:
+            return web.Response(status=503)
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Telegram шлёт по одному апдейту; список принимаем для пакетной отправки
+        items = data if isinstance(data, list) else [data]
+        for item in items:
+            self._raw.put_nowait(item)
+        self.received += len(items)
+        return web.Response()
+
+    async def _decode_loop(self):
+        while True:
+            batch = [await self._raw.get()]
+            while len(batch) < self.max_batch and not self._raw.empty():
+                batch.append(self._raw.get_nowait())
+            if self.router is not None:
+                self._forward(batch)
+            else:
+                self._decode(batch)
+            self._batches.append(len(batch))
+            # Отдаём цикл хендлерам между пачками
+            await asyncio.sleep(0)
+
+    def _forward(self, batch: list):
+        try:
+            self.router(batch)
+            self.decoded += len(batch)
+        except Exception as e:
+            logger.error(f'Не удалось передать пачку апдейтов: {e}')
+        finally:
+            for _ in batch:
+                self._raw.task_done()
+
+    def _decode(self, batch: list):
+        bot = self.application.bot
+        update_queue = self.application.update_queue
+        for data in batch:
+            try:
+                update_queue.put_nowait(Update.de_json(data, bot))
+                self.decoded += 1
+            except Exception as e:
+                logger.error(f'Не удалось разобрать апдейт из webhook: {e}')
+            finally:
+                self._raw.task_done()
+
+    def stats(self) -> dict:
+        """Принято, отклонено и размер пачек разбора"""
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'decoded': self.decoded,
+            'backlog': self._raw.qsize(),
+            'batch_p50': percentile(self._batches, 0.5),
+            'batch_max': max(self._batches, default=0),
+        }
+
+
+async def serve(application, server: WebhookServer, url: str, max_connections: int = 40):
+    """
+    Жизненный цикл бота в режиме webhook (аналог run_polling): инициализация,
+    post_init, регистрация webhook в Telegram, работа до SIGINT/SIGTERM и
+    плавная остановка с post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.start()
+        await application.bot.set_webhook(
+            url,
+            secret_token=server.secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=max_connections,
+        )
+        logger.info(f'Webhook зарегистрирован: {url}')
+        await stop.wait()
+        logger.info('Остановка: дорабатываем принятые апдейты')
+    finally:
+        started = time.monotonic()
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f'Бот остановлен за {time.monotonic() - started:.1f} сек')
@@ -0,0 +1,111 @@
+"""
+Отложенная (write-behind) запись строк в БД пачками.
+
+Частые мелкие записи (логи запросов, журнал токенов) не занимают поток БД
+по коммиту на строку: строки копятся в памяти и уходят одним вызовом
+write(rows) - как только набралось flush_rows строк или прошло
+flush_interval секунд с первой из них. При остановке остаток записывается
+до закрытия БД. Если запись не удалась, пачка возвращается в начало
+буфера и уйдёт со следующей попыткой.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Буфер строк с пакетной записью через write(rows) (корутина хранилища)"""
+
+    # Что копится в буфере - для сообщений об ошибках записи
+    label = 'строки'
+
+    def __init__(self, write, flush_rows: int, flush_interval: float):
+        self._write = write
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_task = None
+        self.written = 0
+        self.flushes = 0
+
+    async def start(self):
+        """Запуск фоновой записи"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Остановка фоновой записи и запись остатка буфера"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_rows.wait()
+            try:
+                # Пишем по заполнению пачки или через flush_interval после первой строки
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f'Не удалось записать {self.label} ({len(self._buffer)} в буфере): {e}')
+                await asyncio.sleep(self.flush_interval)
+
+    def _append(self, row: tuple):
+        self._buffer.append(row)
+        self._has_rows.set()
+        if len(self._buffer) >= self.flush_rows:
+            self._full.set()
+
+    def _discard(self, row: tuple) -> bool:
+        """Удаление ещё не записанной строки (последней из равных); False - её уже нет в буфере"""
+        for i in range(len(self._buffer) - 1, -1, -1):
+            if self._buffer[i] == row:
+                del self._buffer[i]
+                if not self._buffer:
+                    self._has_rows.clear()
+                return True
+        return False
+
+    def _detached(self, rows: list[tuple]):
+        """Пачка ушла из буфера на запись (для учёта в наследниках)"""
+
+    def _restored(self, rows: list[tuple]):
+        """Запись пачки не удалась, строки снова в буфере"""
+
+    async def flush(self):
+        """Запись накопленных строк одной транзакцией"""
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        self._has_rows.clear()
+        self._detached(rows)
+        try:
+            await self._write(rows)
+        except Exception:
+            self._buffer[:0] = rows
+            self._restored(rows)
+            self._has_rows.set()
+            raise
+        self.written += len(rows)
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        """Размер буфера и счётчики записи"""
+        return {
+            'buffered': len(self._buffer),
+            'written': self.written,
+            'flushes': self.flushes,
+        }